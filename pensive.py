@@ -21,10 +21,32 @@ import os
 import os.path
 import sys
 import time
+import bisect
+import heapq
+import itertools
+import collections
+import functools
+import fnmatch
+import re
 import subprocess
 import shutil
 import sqlite3
-from string import ascii_letters, digits
+import argparse
+import threading
+import tempfile
+import gzip
+import zlib
+import hashlib
+import concurrent.futures
+import json
+import tarfile
+import io
+import statistics
+import contextlib
+import urllib.request
+import urllib.parse
+import urllib.error
+from string import ascii_uppercase, digits
 
 # global variables
 HOME = subprocess.getoutput('echo $HOME')
@@ -32,6 +54,140 @@ TERMINAL_WIDTH = shutil.get_terminal_size()[0]
 BLUE = '\033[94m'
 RED = '\033[31m'
 DEL_COLOR = '\033[0m'
+tag_results = []
+tag_rows = {}
+tag_ids = {}
+overview_tag = None
+FULLTEXT_ENABLED = False
+BATCH_MODE = False
+running_backups = []
+attachment_cache = {}
+attachment_checks = {}
+attachment_pool = None
+ATTACHMENT_THREADS = 16
+URL_CHECK_TIMEOUT = 10
+OVERVIEW_CACHE_SIZE = 256
+BLOCK_CACHE_ROWS = 1000
+overview_cache = collections.OrderedDict()
+block_cache = collections.OrderedDict()
+cache_stats = collections.Counter()
+INCREMENTAL_STORE = 'incremental.db'
+BACKUP_CATALOG = 'catalog.db'
+EXPORT_THREADS = 4
+EXPORT_QUEUE = 256
+EXPORT_FORMATS = ('txt', 'jsonl', 'tar', 'sql')
+IMPORT_BATCH = 10000
+ENTRY_COLUMNS = {
+    0: ('tag', 'description'),
+    1: ('tag', 'posnr', 'title', 'description'),
+    2: ('tag', 'posnr', 'title', 'description', 'attachment')}
+ENTRY_KEYS = {
+    1: ('tag', 'title', 'description'),
+    2: ('tag', 'title', 'description', 'attachment')}
+ENTRY_TABLES = {
+    0: (
+        "CREATE TABLE %s( "
+        "tag TEXT, "
+        "description TEXT, "
+        "UNIQUE(tag), "
+        "FOREIGN KEY(tag) REFERENCES pensive_tags)"),
+    1: (
+        "CREATE TABLE %s( "
+        "id INTEGER PRIMARY KEY, "
+        "tag TEXT, "
+        "posnr INTEGER, "
+        "title TEXT, "
+        "description TEXT, "
+        "FOREIGN KEY(tag) REFERENCES pensive_tags)"),
+    2: (
+        "CREATE TABLE %s( "
+        "id INTEGER PRIMARY KEY, "
+        "tag TEXT, "
+        "posnr INTEGER, "
+        "title TEXT, "
+        "description TEXT, "
+        "attachment TEXT, "
+        "FOREIGN KEY(tag) REFERENCES pensive_tags)")}
+SCHEMA_VERSION = 3
+CACHED_STATEMENTS = 512
+JOURNAL_MODES = ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+SYNCHRONOUS_MODES = ('off', 'normal', 'full', 'extra')
+TEMP_STORES = ('default', 'file', 'memory')
+MMAP_MIN_SIZE = 67108864
+NETWORK_FILESYSTEMS = (
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'fuse.sshfs', '9p', 'afs', 'ceph',
+    'glusterfs', 'fuse.glusterfs', 'lustre', 'gpfs')
+BENCHMARK_RUNS = 5
+WRITE_RETRIES = 5
+WRITE_BACKOFF = 0.1
+data_version = None
+
+
+def clear_screen():
+    """Clears the terminal unless pensive runs in batch mode."""
+    if not BATCH_MODE:
+        os.system('clear')
+
+
+def commit():
+    """Commits the current transaction. In batch mode, all changes are
+    committed at once by run_batch()."""
+    if not BATCH_MODE:
+        con.commit()
+
+
+def is_locked_error(error):
+    """Returns True, if the sqlite3.OperationalError error was raised, because
+    another process holds a lock on the database."""
+    return 'database is locked' in str(error) or 'database is busy' in str(
+        error)
+
+
+def execute_write(statements):
+    """Executes the writing statements [(query, parameters)] in a single
+    transaction and commits it right away, so that the write lock is released
+    quickly. Statements given as (query, rows, True) are executed with
+    executemany(). If another process holds the lock longer than
+    BUSY_TIMEOUT, the transaction is retried WRITE_RETRIES times with
+    exponential backoff, before the error is raised. On errors, the
+    transaction is rolled back unless pensive runs in batch mode, where
+    run_batch() takes care of it."""
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            for query, parameters, *many in statements:
+                if many and many[0]:
+                    cursor.executemany(query, parameters)
+                else:
+                    cursor.execute(query, parameters)
+            commit()
+            return
+        except sqlite3.Error as error:
+            if BATCH_MODE:
+                raise
+            con.rollback()
+            if not is_locked_error(error) or attempt == WRITE_RETRIES:
+                raise
+            time.sleep(WRITE_BACKOFF * 2 ** attempt)
+
+
+def sync_external_changes(active_tag):
+    """Reloads categories and tags, which drops the caches, if another
+    process committed to the database since the last call, and returns the
+    active tag, if it still exists, whose overview is fetched again. PRAGMA
+    data_version changes with each commit of another connection."""
+    global data_version
+    cursor.execute("PRAGMA data_version")
+    version = cursor.fetchone()[0]
+    if data_version is not None and version != data_version:
+        get_categories()
+        get_tags()
+        if active_tag not in defined_tags:
+            active_tag = None
+        else:
+            get_overview(active_tag)
+    data_version = version
+    return active_tag
+
 
 def display_help():
     """Print help."""
@@ -39,7 +195,7 @@ def display_help():
     add TAG [TAG2]      - add tag(s)
     rm TAG [TAG2]       - remove tag(s) with all its entries
     mv TAG1 TAG2        - rename TAG1 as TAG2
-    ls [*PAT*ERN*]      - list all tags [matching * globbed pattern]
+    ls [*PAT?ERN*]      - list all tags [matching globbed pattern]
     ?TAG                - query tag, activates tag mode
     ??PATTERN           - search for pattern in all tags and their entries
 
@@ -60,8 +216,14 @@ manage pensive functions:
     category rm NAME    - remove the category NAME from pensive
     category mv OLD NEW - renames a category from OLDNAME to NEWNAME
     backup [NAME]       - backup pensive's current state [as NAME]
+    backup status       - show the progress of running backups
     restore             - restore pensive by choosing backup out of a list
-    export              - export each tag with its entries to a plain text file
+    export [FORMAT]     - export each tag with its entries to a plain text file
+                          or to a single file (FORMAT: txt, jsonl, tar, sql)
+    import PATH         - import an export of any format
+    check               - report broken attachments of all categories
+    stats               - show the storage settings and cache statistics
+    benchmark [TAG]     - compare lookups of TAG with and without mmap
     """)
 
 
@@ -76,13 +238,33 @@ def display_license():
 
 def get_configuration():
     global DB, BACKUPDIR, EXPORTDIR, EDITOR, BROWSER, HIGHLIGHT_TAGS, FORM2MODE
+    global FULLTEXT_SEARCH, BACKUP_FORMAT, BACKUP_PAGES, BACKUP_THROTTLE
+    global EXPORT_FORMAT, IMPORT_FAST, PAGER, ATTACHMENT_TTL, ATTACHMENT_WAIT
+    global URL_CHECK_ENDPOINT, JOURNAL_MODE, SYNCHRONOUS, CACHE_SIZE, MMAP_SIZE
+    global TEMP_STORE, BUSY_TIMEOUT
     DB = 'pensive.sqlite'
     BACKUPDIR = 'backups'
     EXPORTDIR = 'exports'
     EDITOR = 'vi'
     BROWSER = 'firefox'
+    PAGER = ''
     HIGHLIGHT_TAGS = True
     FORM2MODE = 0
+    FULLTEXT_SEARCH = False
+    BACKUP_FORMAT = 'sqlite'
+    BACKUP_PAGES = 256
+    BACKUP_THROTTLE = 0
+    EXPORT_FORMAT = 'txt'
+    IMPORT_FAST = False
+    ATTACHMENT_TTL = 60
+    ATTACHMENT_WAIT = 0.5
+    URL_CHECK_ENDPOINT = ''
+    JOURNAL_MODE = 'wal'
+    SYNCHRONOUS = 'normal'
+    CACHE_SIZE = -16000
+    MMAP_SIZE = 'auto'
+    TEMP_STORE = 'memory'
+    BUSY_TIMEOUT = 5000
 
     red_error = RED + "Error:" + DEL_COLOR
     if os.path.exists('pensive.conf'):
@@ -100,6 +282,8 @@ def get_configuration():
                     EDITOR = line.split('EDITOR = ')[1]
                 elif line.startswith('BROWSER = '):
                     BROWSER = line.split('BROWSER = ')[1]
+                elif line.startswith('PAGER = '):
+                    PAGER = line.split('PAGER = ')[1]
                 elif line.startswith('HIGHLIGHT_TAGS = '):
                     line = line.split('HIGHLIGHT_TAGS = ')[1]
                     if line == 'True' or line == 'False':
@@ -118,17 +302,211 @@ def get_configuration():
                             "%s Invalid configuration of FORM2MODE. "
                             "Using fallback value 0 instead.\n" % red_error)
                         FORM2MODE = 0
+                elif line.startswith('FULLTEXT_SEARCH = '):
+                    line = line.split('FULLTEXT_SEARCH = ')[1]
+                    if line == 'True' or line == 'False':
+                        FULLTEXT_SEARCH = line == 'True'
+                    else:
+                        print(
+                            "%s Invalid configuration of FULLTEXT_SEARCH. "
+                            "Using fallback value False instead.\n" % red_error)
+                elif line.startswith('BACKUP_FORMAT = '):
+                    line = line.split('BACKUP_FORMAT = ')[1]
+                    if line in ('sqlite', 'gzip', 'incremental'):
+                        BACKUP_FORMAT = line
+                    else:
+                        print(
+                            "%s Invalid configuration of BACKUP_FORMAT. "
+                            "Using fallback value sqlite instead.\n" % red_error)
+                elif line.startswith('BACKUP_PAGES = '):
+                    line = line.split('BACKUP_PAGES = ')[1]
+                    if line.isdigit() and int(line) > 0:
+                        BACKUP_PAGES = int(line)
+                    else:
+                        print(
+                            "%s Invalid configuration of BACKUP_PAGES. "
+                            "Using fallback value 256 instead.\n" % red_error)
+                elif line.startswith('BACKUP_THROTTLE = '):
+                    line = line.split('BACKUP_THROTTLE = ')[1]
+                    try:
+                        BACKUP_THROTTLE = max(float(line), 0)
+                    except ValueError:
+                        print(
+                            "%s Invalid configuration of BACKUP_THROTTLE. "
+                            "Using fallback value 0 instead.\n" % red_error)
+                elif line.startswith('EXPORT_FORMAT = '):
+                    line = line.split('EXPORT_FORMAT = ')[1]
+                    if line in EXPORT_FORMATS:
+                        EXPORT_FORMAT = line
+                    else:
+                        print(
+                            "%s Invalid configuration of EXPORT_FORMAT. "
+                            "Using fallback value txt instead.\n" % red_error)
+                elif line.startswith('IMPORT_FAST = '):
+                    line = line.split('IMPORT_FAST = ')[1]
+                    if line == 'True' or line == 'False':
+                        IMPORT_FAST = line == 'True'
+                    else:
+                        print(
+                            "%s Invalid configuration of IMPORT_FAST. "
+                            "Using fallback value False instead.\n" % red_error)
+                elif line.startswith('ATTACHMENT_TTL = '):
+                    line = line.split('ATTACHMENT_TTL = ')[1]
+                    try:
+                        ATTACHMENT_TTL = max(float(line), 0)
+                    except ValueError:
+                        print(
+                            "%s Invalid configuration of ATTACHMENT_TTL. "
+                            "Using fallback value 60 instead.\n" % red_error)
+                elif line.startswith('ATTACHMENT_WAIT = '):
+                    line = line.split('ATTACHMENT_WAIT = ')[1]
+                    try:
+                        ATTACHMENT_WAIT = max(float(line), 0)
+                    except ValueError:
+                        print(
+                            "%s Invalid configuration of ATTACHMENT_WAIT. "
+                            "Using fallback value 0.5 instead.\n" % red_error)
+                elif line.startswith('URL_CHECK_ENDPOINT = '):
+                    URL_CHECK_ENDPOINT = line.split('URL_CHECK_ENDPOINT = ')[1]
+                elif line.startswith('JOURNAL_MODE = '):
+                    line = line.split('JOURNAL_MODE = ')[1].lower()
+                    if line in JOURNAL_MODES:
+                        JOURNAL_MODE = line
+                    else:
+                        print(
+                            "%s Invalid configuration of JOURNAL_MODE. "
+                            "Using fallback value wal instead.\n" % red_error)
+                elif line.startswith('SYNCHRONOUS = '):
+                    line = line.split('SYNCHRONOUS = ')[1].lower()
+                    if line in SYNCHRONOUS_MODES:
+                        SYNCHRONOUS = line
+                    else:
+                        print(
+                            "%s Invalid configuration of SYNCHRONOUS. "
+                            "Using fallback value normal instead.\n" % (
+                                red_error))
+                elif line.startswith('CACHE_SIZE = '):
+                    line = line.split('CACHE_SIZE = ')[1]
+                    try:
+                        CACHE_SIZE = int(line)
+                    except ValueError:
+                        print(
+                            "%s Invalid configuration of CACHE_SIZE. "
+                            "Using fallback value -16000 instead.\n" % (
+                                red_error))
+                elif line.startswith('MMAP_SIZE = '):
+                    line = line.split('MMAP_SIZE = ')[1]
+                    if line.isdigit():
+                        MMAP_SIZE = int(line)
+                    elif line != 'auto':
+                        print(
+                            "%s Invalid configuration of MMAP_SIZE. "
+                            "Using fallback value auto instead.\n" % red_error)
+                elif line.startswith('TEMP_STORE = '):
+                    line = line.split('TEMP_STORE = ')[1].lower()
+                    if line in TEMP_STORES:
+                        TEMP_STORE = line
+                    else:
+                        print(
+                            "%s Invalid configuration of TEMP_STORE. "
+                            "Using fallback value memory instead.\n" % (
+                                red_error))
+                elif line.startswith('BUSY_TIMEOUT = '):
+                    line = line.split('BUSY_TIMEOUT = ')[1]
+                    if line.isdigit():
+                        BUSY_TIMEOUT = int(line)
+                    else:
+                        print(
+                            "%s Invalid configuration of BUSY_TIMEOUT. "
+                            "Using fallback value 5000 instead.\n" % (
+                                red_error))
     else:
         print(
             "%s Configuration file doesn't exist. "
             "Using fallack values.\n" % red_error)
 
 
+def connect_db(path):
+    """Connects to the database path and applies the storage profile of
+    pensive.conf. The journal mode is stored in the database, the other
+    settings only last as long as the connection. Locks of other processes
+    are waited for up to BUSY_TIMEOUT milliseconds."""
+    connection = sqlite3.connect(
+        path, timeout=BUSY_TIMEOUT / 1000,
+        cached_statements=CACHED_STATEMENTS)
+    connection.execute("PRAGMA journal_mode = %s" % get_journal_mode(path))
+    connection.execute("PRAGMA synchronous = %s" % SYNCHRONOUS)
+    connection.execute("PRAGMA cache_size = %i" % CACHE_SIZE)
+    connection.execute("PRAGMA mmap_size = %i" % get_mmap_size(path))
+    connection.execute("PRAGMA temp_store = %s" % TEMP_STORE)
+    return connection
+
+
+def get_filesystem(path):
+    """Returns the type of the file system, on which path is located,
+    according to /proc/mounts or None, if it is unknown."""
+    path = os.path.realpath(path)
+    try:
+        fin = open('/proc/mounts')
+    except OSError:
+        return None
+    mount_point, filesystem = '', None
+    with fin:
+        for line in fin:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            mounted = fields[1].replace('\\040', ' ')
+            if len(mounted) > len(mount_point) and (
+                    path == mounted or
+                    path.startswith(mounted.rstrip('/') + '/')):
+                mount_point, filesystem = mounted, fields[2]
+    return filesystem
+
+
+def get_journal_mode(path):
+    """Returns the journal mode for the database path. WAL needs shared memory
+    between the processes, which network file systems don't provide, so
+    'delete' is used there instead."""
+    if JOURNAL_MODE == 'wal' and get_filesystem(path) in NETWORK_FILESYSTEMS:
+        return 'delete'
+    return JOURNAL_MODE
+
+
+def get_mmap_size(path):
+    """Returns the mmap_size for the database path. With MMAP_SIZE = auto,
+    it is twice the size of the database, but at least MMAP_MIN_SIZE, so
+    that reads are served from the page cache without copying. On network
+    file systems memory mapped I/O isn't safe and 0 disables it."""
+    if get_filesystem(path) in NETWORK_FILESYSTEMS:
+        return 0
+    if MMAP_SIZE != 'auto':
+        return MMAP_SIZE
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    return max(2 * size, MMAP_MIN_SIZE)
+
+
+def get_storage_profile():
+    """Returns the storage settings, which are active for con, as
+    [(name, value)]."""
+    profile = []
+    for pragma, names in (
+            ('journal_mode', None), ('synchronous', SYNCHRONOUS_MODES),
+            ('cache_size', None), ('mmap_size', None),
+            ('temp_store', TEMP_STORES)):
+        value = con.execute("PRAGMA %s" % pragma).fetchone()[0]
+        if names is not None:
+            value = names[value]
+        profile.append((pragma, value))
+    return profile
+
+
 def get_categories():
     """Retrieves defined categories from pensive.sqlite and writes them to
     global variable catconf = [(categoryname, categoryformatid, categoryid)].
     """
     global catconf
+    invalidate_cache()
     catconf = []
     query = 'SELECT * FROM pensive_conf'
     cursor.execute(query)
@@ -144,18 +522,120 @@ def display_categories():
         print("    %s = %s (%s)" % (chr(65 + catid), category, catformatid))
 
 
+@functools.lru_cache(maxsize=None)
+def quote_identifier(name):
+    """Returns name quoted as sql identifier."""
+    return '"%s"' % name.replace('"', '""')
+
+
+@functools.lru_cache(maxsize=1024)
+def category_query(query, category):
+    """Returns query with the quoted identifier of category inserted for '%s'.
+    Equal queries are returned as the same string, so sqlite can reuse the
+    prepared statement from its statement cache."""
+    return query % quote_identifier(category)
+
+
+def create_entry_index(category, catformatid):
+    """Creates the (tag, posnr) index of a category with format 1 or 2. Instead
+    of a primary key over the whole entry, which copies every description
+    into the index, triggers reject identical entries of a tag with a
+    sqlite3.IntegrityError. They look up the entries with an equal title,
+    length and beginning of the description in the index entry_key, so only
+    a few descriptions are compared completely. The index only uses
+    functions built into sqlite, so that other programs can still use the
+    database and its dumps."""
+    table = quote_identifier(category)
+    query = "CREATE INDEX %s ON %s(tag, posnr)" % (
+        quote_identifier('%s_tag_posnr' % category), table)
+    cursor.execute(query)
+    query = (
+        "CREATE INDEX %s ON %s(tag, title, length(description), "
+        "substr(description, 1, 64))" % (
+            quote_identifier('%s_entry_key' % category), table))
+    cursor.execute(query)
+    # the unary + keeps sqlite from replacing description in the indexed
+    # expressions by the new value, which would prevent the use of the index
+    match = ' AND '.join([
+        'length(description) = length(new.description)',
+        'substr(description, 1, 64) = substr(new.description, 1, 64)'] + [
+            '%s%s = new.%s' % (
+                '+' if column == 'description' else '', column, column)
+            for column in ENTRY_KEYS[catformatid]])
+    for trigger, event, condition in (
+            ('bi', 'INSERT', ''), ('bu', 'UPDATE', ' AND id != new.id')):
+        cursor.execute((
+            "CREATE TRIGGER %s BEFORE %s ON %s "
+            "WHEN EXISTS(SELECT 1 FROM %s WHERE %s%s) BEGIN "
+            "SELECT RAISE(ABORT, 'identical entry already exists'); END" % (
+                quote_identifier('%s_entry_%s' % (category, trigger)),
+                event, table, table, match, condition)))
+
+
+def drop_entry_index(category):
+    """Removes the indexes of a category and its triggers."""
+    for index in ('tag_posnr', 'entry_key'):
+        index = quote_identifier('%s_%s' % (category, index))
+        cursor.execute("DROP INDEX IF EXISTS %s" % index)
+    for trigger in ('bi', 'bu'):
+        trigger = quote_identifier('%s_entry_%s' % (category, trigger))
+        cursor.execute("DROP TRIGGER IF EXISTS %s" % trigger)
+
+
+def migrate_db():
+    """Migrates the category tables to SCHEMA_VERSION, which is stored as
+    user_version in the database, after taking a backup. Version 1 gives the
+    entries of format 1 and 2 an integer id and replaces their primary key
+    over the whole entry by an index on (tag, posnr). Version 3 replaces the
+    index for the check of identical entries of version 2, which needed a
+    sql function of pensive, by one without it."""
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    backup = backup_db('pre-migration-%i' % time.time())
+    cursor.execute("BEGIN")
+    try:
+        for category, catformatid, __ in catconf:
+            if catformatid == 0:
+                continue
+            if version >= 1:
+                drop_entry_index(category)
+                create_entry_index(category, catformatid)
+                continue
+            drop_fulltext_index(category)
+            temp = '%s_migration' % category
+            columns = ', '.join(ENTRY_COLUMNS[catformatid])
+            cursor.execute(category_query(ENTRY_TABLES[catformatid], temp))
+            query = (
+                "INSERT INTO %s(%s) SELECT %s FROM %s "
+                "ORDER BY tag, posnr" % (
+                    quote_identifier(temp), columns, columns,
+                    quote_identifier(category)))
+            cursor.execute(query)
+            cursor.execute(category_query("DROP TABLE %s", category))
+            query = "ALTER TABLE %s RENAME TO %s" % (
+                quote_identifier(temp), quote_identifier(category))
+            cursor.execute(query)
+            create_entry_index(category, catformatid)
+        cursor.execute("PRAGMA user_version = %i" % SCHEMA_VERSION)
+        con.commit()
+    except sqlite3.Error:
+        con.rollback()
+        raise
+    cursor.execute("VACUUM")
+    if not BATCH_MODE:
+        print("Migrated pensive to version %i, the old state is saved as "
+              "'%s'." % (SCHEMA_VERSION, backup))
+
+
 def add_category_format0(category):
     """Expects a string and adds it as a new category with format 0."""
     sql_insert = (len(catconf), category, 0)
     cursor.execute("INSERT INTO pensive_conf VALUES(?, ?, ?)", sql_insert)
-    query = (
-        "CREATE TABLE %s( "
-        "tag TEXT, "
-        "description TEXT, "
-        "UNIQUE(tag), "
-        "FOREIGN KEY(tag) REFERENCES pensive_tags)" % category)
-    cursor.execute(query)
-    con.commit()
+    cursor.execute(category_query(ENTRY_TABLES[0], category))
+    if FULLTEXT_ENABLED:
+        create_fulltext_index(category, 0)
+    commit()
     get_categories()
 
 
@@ -163,16 +643,11 @@ def add_category_format1(category):
     """Expects a string and adds it as a new category with format 1."""
     sql_insert = (len(catconf), category, 1)
     cursor.execute("INSERT INTO pensive_conf VALUES(?, ?, ?)", sql_insert)
-    query = (
-        "CREATE TABLE %s( "
-        "tag TEXT, "
-        "posnr INTEGER, "
-        "title TEXT, "
-        "description TEXT, "
-        "PRIMARY KEY(tag, title, description), "
-        "FOREIGN KEY(tag) REFERENCES pensive_tags)" % category)
-    cursor.execute(query)
-    con.commit()
+    cursor.execute(category_query(ENTRY_TABLES[1], category))
+    create_entry_index(category, 1)
+    if FULLTEXT_ENABLED:
+        create_fulltext_index(category, 1)
+    commit()
     get_categories()
 
 
@@ -180,17 +655,11 @@ def add_category_format2(category):
     """Expects a string and adds it as a new category with format 2."""
     sql_insert = (len(catconf), category, 2)
     cursor.execute("INSERT INTO pensive_conf VALUES(?, ?, ?)", sql_insert)
-    query = (
-        "CREATE TABLE %s( "
-        "tag TEXT, "
-        "posnr INTEGER, "
-        "title TEXT, "
-        "description TEXT, "
-        "attachment TEXT, "
-        "PRIMARY KEY(tag, title, description, attachment), "
-        "FOREIGN KEY(tag) REFERENCES pensive_tags)" % category)
-    cursor.execute(query)
-    con.commit()
+    cursor.execute(category_query(ENTRY_TABLES[2], category))
+    create_entry_index(category, 2)
+    if FULLTEXT_ENABLED:
+        create_fulltext_index(category, 2)
+    commit()
     get_categories()
 
 
@@ -199,8 +668,10 @@ def remove_category(category):
     this process, pensive_conf will be recreated in order to close possible
     gaps in the column catid and therefore ensure, that one can interact with
     categories normally."""
-    cursor.execute("DROP TABLE %s" % category)
-    cursor.execute("DELETE FROM pensive_conf WHERE category = '%s'" % category)
+    drop_fulltext_index(category)
+    cursor.execute(category_query("DROP TABLE %s", category))
+    query = "DELETE FROM pensive_conf WHERE category = ?"
+    cursor.execute(query, (category,))
     get_categories()
     cursor.execute("DROP TABLE pensive_conf")
     cursor.execute((
@@ -212,33 +683,263 @@ def remove_category(category):
     for i, (category, catformatid, *__) in enumerate(catconf):
         sql_insert = (i, category, catformatid)
         cursor.execute("INSERT INTO pensive_conf VALUES(?, ?, ?)", sql_insert)
-    con.commit()
+    commit()
     get_categories()
 
 
 def rename_category(old_category, new_category):
     """Renames a existing category name to a new, unused one."""
+    query = "UPDATE pensive_conf SET category = ? WHERE category = ?"
+    cursor.execute(query, (new_category, old_category))
+    drop_fulltext_index(old_category)
+    drop_entry_index(old_category)
+    query = "ALTER TABLE %s RENAME TO %s" % (
+        quote_identifier(old_category), quote_identifier(new_category))
+    cursor.execute(query)
+    catformatid = category_format(old_category)
+    if catformatid != 0:
+        create_entry_index(new_category, catformatid)
+    if FULLTEXT_ENABLED:
+        create_fulltext_index(new_category, catformatid)
+    commit()
+    get_categories()
+
+
+def fulltext_index_available():
+    """Checks, if the sqlite library supports FTS5 with the trigram
+    tokenizer."""
+    try:
+        test_con = sqlite3.connect(':memory:')
+        test_con.execute(
+            "CREATE VIRTUAL TABLE test USING fts5(a, tokenize='trigram')")
+        test_con.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def fulltext_index_exists(category):
+    """Checks, if the FTS5 shadow index of a category exists."""
+    query = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?"
+    cursor.execute(query, ('%s_fts' % category,))
+    return cursor.fetchone() is not None
+
+
+def create_fulltext_index(category, catformatid):
+    """Creates a FTS5 shadow index with external content for a category, keeps
+    it in sync with triggers and fills it with the existing entries. The
+    trigram tokenizer allows case insensitive substring matches just like
+    LIKE '%pattern%'."""
+    if catformatid == 0:
+        columns = ['description']
+    elif catformatid == 1:
+        columns = ['title', 'description']
+    else:
+        columns = ['title', 'description', 'attachment']
+    fts = quote_identifier('%s_fts' % category)
+    table = quote_identifier(category)
+    trigger = '%s_fts_%%s' % category
+    new_values = ', '.join(['new.rowid', 'new.tag'] + [
+        'new.' + column for column in columns])
+    old_values = ', '.join(["'delete'", 'old.rowid', 'old.tag'] + [
+        'old.' + column for column in columns])
+    insert_columns = ', '.join(['rowid', 'tag'] + columns)
+    delete_columns = ', '.join([fts, 'rowid', 'tag'] + columns)
     query = (
-        "UPDATE pensive_conf "
-        "SET category = '%s' "
-        "WHERE category = '%s'" % (new_category, old_category))
+        "CREATE VIRTUAL TABLE %s USING fts5("
+        "tag UNINDEXED, %s, content='%s', tokenize='trigram')" % (
+            fts, ', '.join(columns), category.replace("'", "''")))
     cursor.execute(query)
-    query = "ALTER TABLE %s RENAME TO %s" % (old_category, new_category)
+    cursor.execute((
+        "CREATE TRIGGER %s AFTER INSERT ON %s BEGIN "
+        "INSERT INTO %s(%s) VALUES(%s); END" % (
+            quote_identifier(trigger % 'ai'), table, fts, insert_columns,
+            new_values)))
+    cursor.execute((
+        "CREATE TRIGGER %s AFTER DELETE ON %s BEGIN "
+        "INSERT INTO %s(%s) VALUES(%s); END" % (
+            quote_identifier(trigger % 'ad'), table, fts, delete_columns,
+            old_values)))
+    cursor.execute((
+        "CREATE TRIGGER %s AFTER UPDATE ON %s BEGIN "
+        "INSERT INTO %s(%s) VALUES(%s); "
+        "INSERT INTO %s(%s) VALUES(%s); END" % (
+            quote_identifier(trigger % 'au'), table, fts, delete_columns,
+            old_values, fts, insert_columns, new_values)))
+    cursor.execute("INSERT INTO %s(%s) VALUES('rebuild')" % (fts, fts))
+
+
+def drop_fulltext_index(category):
+    """Removes the FTS5 shadow index of a category and its triggers."""
+    for trigger in ('ai', 'ad', 'au'):
+        trigger = quote_identifier('%s_fts_%s' % (category, trigger))
+        cursor.execute("DROP TRIGGER IF EXISTS %s" % trigger)
+    query = category_query("DROP TABLE IF EXISTS %s", category + '_fts')
     cursor.execute(query)
-    con.commit()
-    get_categories()
+
+
+def sync_fulltext_indexes():
+    """Creates missing FTS5 shadow indexes if FULLTEXT_SEARCH is enabled and
+    supported, otherwise existing ones are removed."""
+    global FULLTEXT_ENABLED
+    FULLTEXT_ENABLED = FULLTEXT_SEARCH and fulltext_index_available()
+    if FULLTEXT_SEARCH and not FULLTEXT_ENABLED:
+        print(
+            "%s Your sqlite library doesn't support FTS5 with the trigram "
+            "tokenizer. Using LIKE searches instead.\n" % (
+                RED + "Error:" + DEL_COLOR))
+    for category, catformatid, __ in catconf:
+        if FULLTEXT_ENABLED and not fulltext_index_exists(category):
+            create_fulltext_index(category, catformatid)
+        elif not FULLTEXT_ENABLED and fulltext_index_exists(category):
+            drop_fulltext_index(category)
+    commit()
+
+
+class TagMatcher:
+    """Aho-Corasick automaton of a set of tags, which finds the occurrences of
+    all tags in a line with a single pass over its characters."""
+
+    def __init__(self, tags):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for tag in tags:
+            node = 0
+            for char in tag:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                node = next_node
+            if node:
+                self.output[node] = (len(tag),)
+
+        # link each node to the longest suffix of its path, which is also a
+        # path in the automaton, breadth first
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                self.output[child] += self.output[self.fail[child]]
+
+    @staticmethod
+    def is_boundary(line, position):
+        """Checks, if there is no letter, digit or '_' at position of line."""
+        if position < 0 or position >= len(line):
+            return True
+        char = line[position]
+        return not (char.isalnum() or char == '_')
+
+    def find(self, line):
+        """Returns the (start, end) positions of the tags in line, which are
+        not part of a longer word. Overlapping matches are resolved by
+        preferring the leftmost and then the longest one."""
+        goto, fail, output = self.goto, self.fail, self.output
+        longest = {}
+        node = 0
+        for end, char in enumerate(line, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length in output[node]:
+                start = end - length
+                if (longest.get(start, 0) < length and
+                        self.is_boundary(line, start - 1) and
+                        self.is_boundary(line, end)):
+                    longest[start] = length
+        matches = []
+        position = 0
+        for start in sorted(longest):
+            if start >= position:
+                position = start + longest[start]
+                matches.append((start, position))
+        return matches
+
+
+class TagIndex:
+    """In-memory index of the defined tags. A set answers membership tests in
+    constant time, while a sorted list serves ordered and prefix listings.
+    Both are updated incrementally and version is increased on each change."""
+
+    def __init__(self, tags=()):
+        self.tags = set(tags)
+        self.sorted_tags = sorted(self.tags)
+        self.version = 0
+        self.tag_matcher = None
+        self.tag_matcher_version = None
+
+    def __contains__(self, tag):
+        return tag in self.tags
+
+    def __iter__(self):
+        return iter(self.sorted_tags)
+
+    def __len__(self):
+        return len(self.sorted_tags)
+
+    def add(self, tag):
+        """Adds a single tag if not already indexed."""
+        if tag not in self.tags:
+            self.tags.add(tag)
+            bisect.insort(self.sorted_tags, tag)
+            self.version += 1
+
+    def update(self, tags):
+        """Merges several tags at once into the index."""
+        new_tags = sorted(set(tags) - self.tags)
+        if new_tags:
+            self.tags.update(new_tags)
+            self.sorted_tags = list(heapq.merge(self.sorted_tags, new_tags))
+            self.version += 1
+
+    def remove(self, tag):
+        """Removes a tag if indexed."""
+        if tag in self.tags:
+            self.tags.remove(tag)
+            del self.sorted_tags[bisect.bisect_left(self.sorted_tags, tag)]
+            self.version += 1
+
+    def rename(self, old_tag, new_tag):
+        """Replaces old_tag by new_tag."""
+        if old_tag in self.tags:
+            self.remove(old_tag)
+            self.add(new_tag)
+
+    def matcher(self):
+        """Returns a TagMatcher of the indexed tags, which is only rebuilt
+        after the tags have changed."""
+        if self.tag_matcher_version != self.version:
+            self.tag_matcher = TagMatcher(self.sorted_tags)
+            self.tag_matcher_version = self.version
+        return self.tag_matcher
+
+    def with_prefix(self, prefix):
+        """Returns all tags starting with prefix in sorted order."""
+        start = bisect.bisect_left(self.sorted_tags, prefix)
+        matching_tags = []
+        for tag in itertools.islice(self.sorted_tags, start, None):
+            if not tag.startswith(prefix):
+                break
+            matching_tags.append(tag)
+        return matching_tags
 
 
 def get_tags():
     """Retrieves defined tags from pensive.sqlite and writes them to the
-    global list defined_tags."""
+    global TagIndex defined_tags."""
     global defined_tags
-    defined_tags = []
+    invalidate_cache()
     cursor.execute("SELECT tag FROM pensive_tags")
-    result = cursor.fetchall()
-    for tag, *__ in result:
-        defined_tags.append(tag)
-    defined_tags.sort()
+    defined_tags = TagIndex(tag for tag, *__ in cursor.fetchall())
 
 
 def display_tags():
@@ -262,41 +963,26 @@ def display_tags():
         print('   ', line)
 
 
+@functools.lru_cache(maxsize=32)
+def compile_glob(pattern):
+    """Compiles a globbed pattern into a regular expression."""
+    return re.compile(fnmatch.translate(pattern))
+
+
 def get_specific_tags(pattern):
-    """Filter all defined tags, which match the globbed pattern containing '*'.
-    A given string like '*a*t*a' and would return pasta, if its within
-    defined_tags. The gerneral idea is to seperate the pattern by '*' and to
-    search for the slices in the right order in each tag."""
-    slices = pattern.split('*')
-    matching_tags = []
-    for tag in defined_tags:
-        slices_found = 0
-        last_pos = 0
-        for slice in slices:
-            start_pos = last_pos + 0
-            end_pos = last_pos + len(slice)
-            i = 0
-            while end_pos <= len(tag):
-                if tag[start_pos:end_pos] == slice:
-                    slices_found += 1
-                    last_pos = end_pos
-                    break
-                i += 1
-                start_pos += 1
-                end_pos += 1
-        if slices_found == len(slices):
-            cond0 = pattern.startswith('*') and tag.endswith(slices[len(slices)-1])
-            cond1 = pattern.endswith('*') and tag.startswith(slices[0])
-            cond2 = tag.startswith(slices[0]) and tag.endswith(slices[-1])
-            if ((cond0 and not cond1) or (not cond0 and cond1) or
-                    (cond0 and cond1) or (cond2)):
-                matching_tags.append(tag)
-    return matching_tags
+    """Filter all defined tags, which match the globbed pattern containing '*',
+    '?' or character classes like '[abc]'. A given string like '*a*t*a' would
+    return pasta, if its within defined_tags. The literal prefix of the
+    pattern is looked up in the sorted tags first, so that only tags starting
+    with it have to be tested."""
+    prefix = re.split(r'[*?[]', pattern, maxsplit=1)[0]
+    regex = compile_glob(pattern)
+    return [tag for tag in defined_tags.with_prefix(prefix) if regex.match(tag)]
 
 
 def display_specific_tags(pattern):
-    """Print all defined tags, which match the globbed pattern containing '*'s
-    (case sensitive)."""
+    """Print all defined tags, which match the globbed pattern (case
+    sensitive)."""
     print('tags:')
     matching_tags = get_specific_tags(pattern)
     if matching_tags:
@@ -304,30 +990,40 @@ def display_specific_tags(pattern):
             print('   ', tag)
 
 
+def add_tags_to_db(tags):
+    """Adds several tags to pensive within one transaction and returns the
+    tags, which were not defined before."""
+    new_tags = []
+    seen_tags = set()
+    for tag in tags:
+        # deleate unwanted spaces
+        tag = tag.strip(' ')
+        if tag and tag not in defined_tags and tag not in seen_tags:
+            new_tags.append(tag)
+            seen_tags.add(tag)
+    if new_tags:
+        execute_write([(
+            "INSERT INTO pensive_tags(tag) VALUES(?);",
+            [(tag,) for tag in new_tags], True)])
+        defined_tags.update(new_tags)
+    return new_tags
+
+
 def add_tag_to_db(tag):
     """Adds a tag to pensive if not existing."""
-    tag = (tag,)
-    # deleate unwanted spaces
-    if tag[0] == ' ':
-        tag = tag[1:]
-    if tag[-1] == ' ':
-        tag = tag[:-1]
-    if tag not in defined_tags:
-        cursor.execute("INSERT INTO pensive_tags(tag) VALUES(?);", tag)
-        con.commit()
-        get_tags()
+    add_tags_to_db([tag])
 
 
 def remove_tag_from_db(tag):
     """Removes a tag with all its entries from pensive if existing."""
     if ask_yes_no(name=tag, mode=0):
-        for category, *__ in catconf:
-            query = "DELETE FROM %s WHERE tag = '%s'" % (category, tag)
-            cursor.execute(query)
-        query = "DELETE FROM pensive_tags WHERE tag = '%s'" % tag
-        cursor.execute(query)
-        con.commit()
-        get_tags()
+        statements = [
+            (category_query("DELETE FROM %s WHERE tag = ?", category), (tag,))
+            for category, *__ in catconf]
+        statements.append(("DELETE FROM pensive_tags WHERE tag = ?", (tag,)))
+        execute_write(statements)
+        defined_tags.remove(tag)
+        invalidate_cache(tag)
     else:
         print('Nothing changed.')
 
@@ -335,53 +1031,229 @@ def remove_tag_from_db(tag):
 def rename_tag(oldtag, newtag):
     """Renames a tag."""
     if newtag not in defined_tags:
-        query = "UPDATE pensive_tags SET tag = '%s' WHERE tag = '%s'" % (
-            newtag, oldtag)
-        cursor.execute(query)
+        statements = [(
+            "UPDATE pensive_tags SET tag = ? WHERE tag = ?", (newtag, oldtag))]
         for category, *__ in catconf:
-            query = "UPDATE %s SET tag = '%s' WHERE tag = '%s'" % (
-                category, newtag, oldtag)
-            cursor.execute(query)
-        con.commit()
-        get_tags()
+            query = category_query(
+                "UPDATE %s SET tag = ? WHERE tag = ?", category)
+            statements.append((query, (newtag, oldtag)))
+        execute_write(statements)
+        defined_tags.rename(oldtag, newtag)
+        invalidate_cache(oldtag)
+        invalidate_cache(newtag)
     else:
         print("Can't rename %s to %s: %s is already defined." % (
             oldtag, newtag, newtag))
 
 
 def get_overview(tag):
-    """Retrievs all information about a tag and stores the number of hits in
-    the global variable tag_results in the following order:
-    [(category, catformatid, number_of_hits)]"""
-    global tag_results
+    """Retrieves all information about a tag with a single query over all
+    categories and stores the number of hits in the global variable
+    tag_results in the following order: [(category, catformatid, hits)].
+    The fetched rows are kept in tag_rows = {category: rows}, so that
+    display_overview() and entry_exists() don't have to query them again,
+    and the ids of the displayed entries in tag_ids = {category: ids}.
+    Descriptions of format 1 are not displayed in the overview and therefore
+    not fetched. The results of the last OVERVIEW_CACHE_SIZE tags are cached
+    until invalidate_cache() is called for them."""
+    global tag_results, tag_rows, tag_ids, overview_tag
+    overview_tag = tag
+    if tag in overview_cache:
+        cache_stats['overview hits'] += 1
+        overview_cache.move_to_end(tag)
+        tag_results, tag_rows, tag_ids = overview_cache[tag]
+        return
+    cache_stats['overview misses'] += 1
     tag_results = []
-    for category, catformatid, *__ in catconf:
-        query = "SELECT * FROM %s WHERE tag = '%s'" % (category, tag)
-        cursor.execute(query)
-        tag_results.append((category, catformatid, len(cursor.fetchall())))
+    tag_rows = {}
+    tag_ids = {}
+    selects = []
+    for category, catformatid, catid in catconf:
+        tag_rows[category] = []
+        tag_ids[category] = []
+        if catformatid == 0:
+            columns = "tag, 0, NULL, description, NULL, 0"
+        elif catformatid == 1:
+            columns = "tag, posnr, title, NULL, NULL, id"
+        else:
+            columns = "tag, posnr, title, description, attachment, id"
+        selects.append(
+            "SELECT %i, %s FROM %s WHERE tag = ?" % (
+                catid, columns, quote_identifier(category)))
+    if selects:
+        query = ' UNION ALL '.join(selects) + ' ORDER BY 1, 3, 7'
+        cursor.execute(query, (tag,) * len(selects))
+        for catid, *row in cursor.fetchall():
+            category, catformatid, __ = catconf[catid]
+            if catformatid == 0:
+                tag_rows[category].append((row[3],))
+            elif catformatid == 1:
+                tag_rows[category].append(tuple(row[:4]))
+                tag_ids[category].append(row[5])
+            else:
+                tag_rows[category].append(tuple(row[:5]))
+                tag_ids[category].append(row[5])
+    for category, catformatid, __ in catconf:
+        tag_results.append((category, catformatid, len(tag_rows[category])))
+    overview_cache[tag] = (tag_results, tag_rows, tag_ids)
+    if len(overview_cache) > OVERVIEW_CACHE_SIZE:
+        overview_cache.popitem(last=False)
+
+
+def get_overview_rows(category, tag):
+    """Returns the rows of a category fetched by the last get_overview() if
+    they belong to tag, otherwise None."""
+    if overview_tag == tag:
+        return tag_rows.get(category)
+    return None
+
+
+def get_entry_rows(category, tag):
+    """Returns the entries of tag in a category with format 1 or 2 as rows of
+    ENTRY_COLUMNS in the order of their position."""
+    columns = ', '.join(ENTRY_COLUMNS[category_format(category)])
+    query = category_query(
+        "SELECT %s FROM %%s WHERE tag = ? ORDER BY posnr, id" % columns,
+        category)
+    cursor.execute(query, (tag,))
+    return cursor.fetchall()
+
+
+def get_entry(category, tag, entry_nr):
+    """Returns the entry at position entry_nr of tag in a category with format
+    1 or 2 as (id, *ENTRY_COLUMNS) or None, if there is no such entry. Only
+    this row is read: by the id of the last get_overview() of tag or else by
+    its position with LIMIT 1 OFFSET entry_nr."""
+    columns = ', '.join(ENTRY_COLUMNS[category_format(category)])
+    ids = tag_ids.get(category, []) if overview_tag == tag else []
+    if 0 <= entry_nr < len(ids):
+        query = category_query(
+            "SELECT id, %s FROM %%s WHERE id = ? AND tag = ?" % columns,
+            category)
+        cursor.execute(query, (ids[entry_nr], tag))
+        entry = cursor.fetchone()
+        if entry is not None:
+            return entry
+    query = category_query(
+        "SELECT id, %s FROM %%s WHERE tag = ? "
+        "ORDER BY posnr, id LIMIT 1 OFFSET ?" % columns, category)
+    cursor.execute(query, (tag, entry_nr))
+    return cursor.fetchone()
+
+
+@contextlib.contextmanager
+def paged_output():
+    """Redirects everything printed within the context to PAGER, if it is set
+    and pensive runs interactively in a terminal. The pager reads its input
+    on demand, so entries are only rendered as far as they are paged through
+    and rendering stops, as soon as the pager is quit."""
+    if not PAGER or BATCH_MODE or not sys.stdout.isatty():
+        yield
+        return
+    pager = subprocess.Popen(
+        PAGER, shell=True, stdin=subprocess.PIPE, universal_newlines=True)
+    try:
+        with contextlib.redirect_stdout(pager.stdin):
+            yield
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            pager.stdin.close()
+        except BrokenPipeError:
+            pass
+        pager.wait()
+
+
+def iter_lines(text):
+    """Yields the lines of text like splitting it at each newline does, but
+    without splitting the whole text at once."""
+    start = 0
+    end = text.find('\n')
+    while end != -1:
+        yield text[start:end]
+        start = end + 1
+        end = text.find('\n', start)
+    yield text[start:]
+
+
+def invalidate_cache(tag=None, category=None):
+    """Removes the cached overview and rendered blocks of tag, only the block
+    of category if given, or everything, if tag is None. The rows of the last
+    get_overview() are no longer used for the tag afterwards."""
+    global overview_tag
+    if tag is None or tag == overview_tag:
+        overview_tag = None
+    if tag is None:
+        overview_cache.clear()
+        block_cache.clear()
+        return
+    overview_cache.pop(tag, None)
+    for key in [key for key in block_cache if key[0] == tag and (
+            category is None or key[1] == category)]:
+        del block_cache[key]
+
+
+def show_block(category, catformatid, tag, result):
+    """Prints the results of a category for tag like show_results_form_*()
+    and caches the rendered block by (tag, category, version of the defined
+    tags, HIGHLIGHT_TAGS, FORM2MODE). Blocks with file attachments expire
+    with their cached state and aren't cached, if a state is unknown. Blocks
+    with more than BLOCK_CACHE_ROWS entries are printed right away without
+    caching, so that a pager can stop rendering them early."""
+    key = (tag, category, defined_tags.version, HIGHLIGHT_TAGS, FORM2MODE)
+    block, expires = block_cache.get(key, (None, None))
+    if block is not None and (expires is None or expires > time.time()):
+        cache_stats['block hits'] += 1
+        block_cache.move_to_end(key)
+        print(block, end='')
+        return
+    cache_stats['block misses'] += 1
+    show_results = (
+        show_results_form_0, show_results_form_1,
+        show_results_form_2)[catformatid]
+    if len(result) > BLOCK_CACHE_ROWS:
+        show_results(category, tag, result)
+        return
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        show_results(category, tag, result)
+    block = buffer.getvalue()
+    print(block, end='')
+    expires = None
+    if catformatid == 2:
+        checked = [
+            attachment_cache.get(attachment) for *__, attachment in result
+            if classify_attachment(attachment) == 'File']
+        if None in checked:
+            return
+        if checked:
+            expires = min(
+                checked_at for __, checked_at in checked) + ATTACHMENT_TTL
+    block_cache[key] = (block, expires)
+    if len(block_cache) > OVERVIEW_CACHE_SIZE:
+        block_cache.popitem(last=False)
 
 
 def display_overview(tag):
-    """Prints all entries of a tag in accordance to display_overview()."""
+    """Prints all entries of a tag in accordance to get_overview()."""
     get_overview(tag)
-    for category, catformatid, hits in tag_results:
-        if hits > 0:
-            if catformatid == 0:
-                show_results_form_0(category, tag)
-            elif catformatid == 1:
-                show_results_form_1(category, tag)
-            elif catformatid == 2:
-                show_results_form_2(category, tag)
+    with paged_output():
+        for category, catformatid, hits in tag_results:
+            if hits > 0:
+                show_block(category, catformatid, tag, tag_rows[category])
 
 
-def show_results_form_0(category, tag):
+def show_results_form_0(category, tag, result=None):
     """Displays results of entries with format 0"""
-    query = "SELECT description FROM %s WHERE tag = '%s'" % (category, tag)
-    cursor.execute(query)
-    result = cursor.fetchall()
+    if result is None:
+        query = category_query(
+            "SELECT description FROM %s WHERE tag = ?", category)
+        cursor.execute(query, (tag,))
+        result = cursor.fetchall()
     if result:
         result = result[0][0]
-        lines = result.split('\n')
+        lines = iter_lines(result)
         print('%s:' % category)
         if HIGHLIGHT_TAGS:
             [print('   ', highlight_by_known_tags(line)) for line in lines]
@@ -391,11 +1263,10 @@ def show_results_form_0(category, tag):
         print('%s:\n' % category)
 
 
-def show_results_form_1(category, tag):
+def show_results_form_1(category, tag, result=None):
     """Displays results of entries with format 1."""
-    query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (category, tag)
-    cursor.execute(query)
-    result = cursor.fetchall()
+    if result is None:
+        result = get_entry_rows(category, tag)
     if result:
         print('%s:' % category)
         for i, (*__, title, __) in enumerate(result):
@@ -406,11 +1277,161 @@ def show_results_form_1(category, tag):
         print()
 
 
-def show_results_form_2(category, tag):
-    """Displays results of entries with format 2."""
-    query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (category, tag)
-    cursor.execute(query)
-    result = cursor.fetchall()
+def classify_attachment(attachment):
+    """Guesses the type of an attachment: 'File', 'Tag' or 'URL'."""
+    if '://' in attachment:
+        return 'URL'
+    elif '/' in attachment:
+        return 'File'
+    return 'Tag'
+
+
+def tag_attachment_exists(attachment):
+    """Checks, if an attachment refers to a defined tag or, ending with '.',
+    to the tags below it."""
+    return attachment in defined_tags or (
+        attachment.endswith('.') and attachment[:-1] in defined_tags)
+
+
+def check_attachment(attachment):
+    """Checks, if the file of an attachment exists, and caches the result with
+    the time of the check. Paths starting with '~/' are also looked up in
+    HOME."""
+    exists = os.path.exists(attachment) or (
+        attachment.startswith('~/') and os.path.exists(HOME + attachment[1:]))
+    attachment_cache[attachment] = (exists, time.time())
+    return exists
+
+
+def finish_attachment_check(attachment, future):
+    """Removes the finished check future of an attachment from
+    attachment_checks, so that it can be checked again."""
+    if attachment_checks.get(attachment) is future:
+        del attachment_checks[attachment]
+
+
+def get_attachment_pool():
+    """Returns the thread pool for attachment checks and starts it first."""
+    global attachment_pool
+    if attachment_pool is None:
+        attachment_pool = concurrent.futures.ThreadPoolExecutor(
+            ATTACHMENT_THREADS)
+    return attachment_pool
+
+
+def start_attachment_checks(attachments):
+    """Checks all file attachments, which aren't cached yet or whose cache
+    entry is older than ATTACHMENT_TTL seconds, concurrently on a thread
+    pool."""
+    pool = get_attachment_pool()
+    now = time.time()
+    for attachment in attachments:
+        cached = attachment_cache.get(attachment)
+        if attachment in attachment_checks:
+            continue
+        if cached is None or now - cached[1] > ATTACHMENT_TTL:
+            future = pool.submit(check_attachment, attachment)
+            attachment_checks[attachment] = future
+            # registered after the assignment, since the check may already
+            # be done, in which case the callback runs right away
+            future.add_done_callback(
+                functools.partial(finish_attachment_check, attachment))
+
+
+def get_attachment_status(attachment, deadline):
+    """Returns the cached existence of a file attachment, even if it is being
+    refreshed. Without a cache entry, its check is waited for until deadline
+    and None is returned, if the state is still unknown by then."""
+    cached = attachment_cache.get(attachment)
+    future = attachment_checks.get(attachment)
+    if cached is None and future is not None:
+        try:
+            return future.result(timeout=max(deadline - time.time(), 0))
+        except concurrent.futures.TimeoutError:
+            return None
+    cached = attachment_cache.get(attachment)
+    return None if cached is None else cached[0]
+
+
+def check_url(url):
+    """Asks URL_CHECK_ENDPOINT, if url is reachable, and returns None or the
+    reason, why it isn't. The endpoint gets url as query parameter 'url' and
+    has to answer with a 2xx status code."""
+    separator = '&' if '?' in URL_CHECK_ENDPOINT else '?'
+    request = URL_CHECK_ENDPOINT + separator + urllib.parse.urlencode(
+        {'url': url})
+    try:
+        urllib.request.urlopen(request, timeout=URL_CHECK_TIMEOUT).close()
+    except urllib.error.HTTPError as error:
+        return 'HTTP %i' % error.code
+    except urllib.error.URLError as error:
+        return str(error.reason)
+    except OSError as error:
+        return str(error)
+    return None
+
+
+def check_all_attachments():
+    """Checks the attachments of all categories with format 2 like
+    show_results_form_2() does and returns the broken ones as [(tag, category,
+    entry_nr, title, attachment, reason)] and the number of checked
+    attachments by type. Distinct files are checked concurrently on the
+    attachment thread pool and URLs only, if URL_CHECK_ENDPOINT is set."""
+    counts = {'File': 0, 'Tag': 0, 'URL': 0}
+    entries = []
+    files = set()
+    urls = set()
+    for category, catformatid, __ in catconf:
+        if catformatid != 2:
+            continue
+        query = category_query(
+            "SELECT tag, title, attachment FROM %s ORDER BY tag, posnr, id",
+            category)
+        rows = con.execute(query)
+        for tag, group in itertools.groupby(rows, key=lambda row: row[0]):
+            for entry_nr, (__, title, attachment) in enumerate(group):
+                attachment_type = classify_attachment(attachment)
+                counts[attachment_type] += 1
+                if attachment_type == 'File':
+                    files.add(attachment)
+                elif attachment_type == 'URL':
+                    if not URL_CHECK_ENDPOINT:
+                        continue
+                    urls.add(attachment)
+                entries.append(
+                    (tag, category, entry_nr, title, attachment,
+                     attachment_type))
+    pool = get_attachment_pool()
+    files = list(files)
+    file_status = dict(zip(files, pool.map(check_attachment, files)))
+    urls = list(urls)
+    url_status = dict(zip(urls, pool.map(check_url, urls)))
+    broken = []
+    for *entry, attachment, attachment_type in entries:
+        if attachment_type == 'File':
+            reason = None if file_status[attachment] else 'missing file'
+        elif attachment_type == 'Tag':
+            reason = None if tag_attachment_exists(attachment) else (
+                'undefined tag')
+        else:
+            reason = url_status[attachment]
+        if reason is not None:
+            broken.append((*entry, attachment, reason))
+    return broken, counts
+
+
+def show_results_form_2(category, tag, result=None):
+    """Displays results of entries with format 2. The existence of file
+    attachments is taken from a cache and stale entries are checked
+    concurrently, so entries are printed as soon as their check finishes.
+    Files, whose check takes longer than ATTACHMENT_WAIT seconds, are printed
+    uncolored and updated in the cache later on."""
+    if result is None:
+        result = get_entry_rows(category, tag)
+    start_attachment_checks(
+        attachment for *__, attachment in result
+        if classify_attachment(attachment) == 'File')
+    deadline = time.time() + ATTACHMENT_WAIT
     print('%s:' % category)
     for i, (*__, title, description, attachment) in enumerate(result):
         # add description if existing
@@ -420,25 +1441,13 @@ def show_results_form_2(category, tag):
             description = ''
 
         # guess type and existance of attachment
-        attachment_type = ''
+        attachment_type = classify_attachment(attachment)
         attachment_exists = None
-        if '://' not in attachment and '/' in attachment:
-            attachment_type = 'File'
-            if os.path.exists(attachment) or (attachment.startswith('~/') and
-                    os.path.exists(HOME + attachment[1:])):
-                attachment_exists = True
-            else:
-                attachment_exists = False
-        elif '://' not in attachment and '/' not in attachment:
-            attachment_type = 'Tag'
-            if attachment in defined_tags:
-                attachment_exists = True
-            elif attachment[:-1] in defined_tags and attachment.endswith('.'):
-                attachment_exists = True
-            else:
-                attachment_exists = False
+        if attachment_type == 'File':
+            attachment_exists = get_attachment_status(attachment, deadline)
+        elif attachment_type == 'Tag':
+            attachment_exists = tag_attachment_exists(attachment)
         else:
-            attachment_type = 'URL'
             attachment_exists = True
 
         # print title and attachment in seperate lines
@@ -449,7 +1458,9 @@ def show_results_form_2(category, tag):
                 print('   [%i] %s%s' % (i, title, description))
             else:
                 print('    [%i] %s%s' % (i, title, description))
-            if attachment_exists:
+            if attachment_exists is None:
+                print('        ' + attachment)
+            elif attachment_exists:
                 print(attachment_blue)
             else:
                 print(attachment_red)
@@ -466,8 +1477,10 @@ def show_results_form_2(category, tag):
                 index = '   [%s|' % i
             else:
                 index = '    [%s|' % i
-            if attachment_exists:
-                if attachment_type is 'URL':
+            if attachment_exists is None:
+                print(index, '?] %s%s' % (title, description), sep='')
+            elif attachment_exists:
+                if attachment_type == 'URL':
                     print(index, attachment_URL, sep='')
                 else:
                     print(index, attachment_blue, sep='')
@@ -478,13 +1491,10 @@ def show_results_form_2(category, tag):
 
 def show_single_entry_form_1(category, tag, entry_nr):
     """Displays single entry with format 1."""
-    query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (category, tag)
-    cursor.execute(query)
-    result = cursor.fetchall()
-    if result:
-        title = result[entry_nr][2]
-        description = result[entry_nr][3]
-        lines = description.split('\n')
+    entry = get_entry(category, tag, entry_nr)
+    if entry is not None:
+        *__, title, description = entry
+        lines = iter_lines(description)
         print('%s:' % title)
         if HIGHLIGHT_TAGS:
             [print('   ', highlight_by_known_tags(line)) for line in lines]
@@ -494,12 +1504,11 @@ def show_single_entry_form_1(category, tag, entry_nr):
 
 
 def open_attachment_form_2(category, tag, entry_nr):
-    """Opens a single attachment of format 2."""
-    query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (category, tag)
-    cursor.execute(query)
-    result = cursor.fetchall()
-    if result:
-        attachment = result[entry_nr][4]
+    """Opens a single attachment of format 2 and returns the tag, which should
+    be active afterwards."""
+    entry = get_entry(category, tag, entry_nr)
+    if entry is not None:
+        attachment = entry[-1]
         # escape spaces if present
         if ' ' in attachment:
             attachment = attachment.split(' ')
@@ -513,25 +1522,53 @@ def open_attachment_form_2(category, tag, entry_nr):
             os.system(attachment)
         else:
             if attachment in defined_tags:
-                os.system('clear')
-                get_overview(attachment)
-                pensive_shell(attachment)
+                clear_screen()
+                display_overview(attachment)
+                return attachment
             elif attachment[:-1] in defined_tags and attachment.endswith('.'):
-                os.system('clear')
-                display_specific_tags(attachment)
+                clear_screen()
+                display_specific_tags(attachment + '*')
             else:
                 print(
                     "Tag '%s' is not defined yet. "
                     "How about adding it with 'add %s'?" % (
                         attachment, attachment))
-                pensive_shell(tag)
+    return tag
+
+
+def make_temp_file():
+    """Creates an empty temporary file for editing an entry, which isn't
+    shared with other instances of pensive, and returns its path."""
+    fd, temp_file = tempfile.mkstemp(prefix='pensive-', suffix='.temp')
+    os.close(fd)
+    return temp_file
+
+
+def save_edit(temp_file, query, parameters):
+    """Writes an edited entry with execute_write() and removes temp_file.
+    Returns False and keeps temp_file, so that the edit isn't lost, if the
+    database stays locked by another process."""
+    try:
+        execute_write([(query, parameters)])
+    except sqlite3.Error as error:
+        if not is_locked_error(error):
+            os.remove(temp_file)
+            raise
+        print(
+            "%s The entry couldn't be saved (%s). "
+            "Your edit is kept in '%s'." % (
+                RED + "Error:" + DEL_COLOR, error, temp_file))
+        return False
+    os.remove(temp_file)
+    return True
 
 
 def edit_and_update_form_0(category, tag):
     """Edit entry with format 0 with EDITOR and save updates, if any."""
-    temp_file = str(os.getcwd()) + '/pensive.temp'
-    query = "SELECT description FROM %s WHERE tag = '%s'" % (category, tag)
-    cursor.execute(query)
+    temp_file = make_temp_file()
+    query = category_query(
+        "SELECT description FROM %s WHERE tag = ?", category)
+    cursor.execute(query, (tag,))
     result = cursor.fetchall()
     if result:
         old_description = result[0][0]
@@ -557,24 +1594,26 @@ def edit_and_update_form_0(category, tag):
         fin.close()
         if old_description == '':
             sql_insert = (tag, description)
-            query = "INSERT INTO %s VALUES(?, ?)" % category
+            query = category_query("INSERT INTO %s VALUES(?, ?)", category)
         else:
             sql_insert = (description, tag)
-            query = "UPDATE %s SET description = ? WHERE tag = ?" % category
-        cursor.execute(query, sql_insert)
-        con.commit()
+            query = category_query(
+                "UPDATE %s SET description = ? WHERE tag = ?", category)
+        if save_edit(temp_file, query, sql_insert):
+            invalidate_cache(tag, category)
+    else:
+        os.remove(temp_file)
 
 
 def edit_and_update_form_1(category, tag, entry_nr=None):
     """Edit entry with format 1 with EDITOR and save updates, if any."""
-    temp_file = str(os.getcwd()) + '/pensive.temp'
     new_entry = False
     if entry_nr is not None:
-        query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (
-            category, tag)
-        cursor.execute(query)
-        result = cursor.fetchall()
-        __, old_posnr, old_title, old_description = result[entry_nr]
+        entry = get_entry(category, tag, entry_nr)
+        if entry is None:
+            print("The entry doesn't exist anymore, operation canceled.")
+            return
+        entry_id, __, old_posnr, old_title, old_description = entry
         tempcontent = [
             "[posnr]: %s\n" % old_posnr,
             "[title]: %s\n" % old_title,
@@ -588,6 +1627,7 @@ def edit_and_update_form_1(category, tag, entry_nr=None):
             "[description]: (This line will be skipped)\n"]
 
     # paste into temp file and call editor
+    temp_file = make_temp_file()
     fout = open(temp_file, mode='w')
     with fout:
         for line in tempcontent:
@@ -615,29 +1655,33 @@ def edit_and_update_form_1(category, tag, entry_nr=None):
 
         if new_entry:
             sql_insert = (tag, posnr, title, description)
-            query = "INSERT INTO %s VALUES(?, ?, ?, ?)" % category
+            query = category_query(
+                "INSERT INTO %s(tag, posnr, title, description) "
+                "VALUES(?, ?, ?, ?)", category)
         else:
-            sql_insert = (posnr, title, description, old_title, old_description)
-            query = (
+            sql_insert = (posnr, title, description, entry_id)
+            query = category_query(
                 "UPDATE %s "
                 "SET posnr = ?, title = ?, description = ? "
-                "WHERE title = ? AND description = ?" % category)
-        cursor.execute(query, sql_insert)
-        con.commit()
+                "WHERE id = ?", category)
+        if save_edit(temp_file, query, sql_insert):
+            invalidate_cache(tag, category)
+    else:
+        os.remove(temp_file)
 
 
 def edit_and_update_form_2(category, tag, entry_nr=None):
     """Edit entry with format 2 with EDITOR and save updates, if any."""
-    temp_file = str(os.getcwd()) + '/pensive.temp'
     new_entry = False
     if entry_nr is not None:
-        query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (
-            category, tag)
-        cursor.execute(query)
-        result = cursor.fetchall()
+        entry = get_entry(category, tag, entry_nr)
+        if entry is None:
+            print("The entry doesn't exist anymore, operation canceled.")
+            return
         (
-            __, old_posnr, old_title, old_description, old_attachment
-        ) = result[entry_nr]
+            entry_id, __, old_posnr, old_title, old_description,
+            old_attachment
+        ) = entry
         tempcontent = [
             "[posnr]: %s\n" % old_posnr,
             "[title]: %s\n" % old_title,
@@ -653,6 +1697,7 @@ def edit_and_update_form_2(category, tag, entry_nr=None):
             "[description]: \n"]
 
     # paste into temp file and call editor
+    temp_file = make_temp_file()
     fout = open(temp_file, mode='w')
     with fout:
         for line in tempcontent:
@@ -676,84 +1721,100 @@ def edit_and_update_form_2(category, tag, entry_nr=None):
         fin.close()
         if new_entry:
             sql_insert = (tag, posnr, title, description, attachment)
-            query = "INSERT INTO %s VALUES(?, ?, ?, ?, ?)" % category
+            query = category_query(
+                "INSERT INTO %s(tag, posnr, title, description, attachment) "
+                "VALUES(?, ?, ?, ?, ?)", category)
         else:
-            sql_insert = (
-                posnr, title, description, attachment, 
-                tag, old_title, old_attachment)
-            query = (
+            sql_insert = (posnr, title, description, attachment, entry_id)
+            query = category_query(
                 "UPDATE %s "
                 "SET posnr = ?, title = ?, description = ?, "
                 "attachment = ? "
-                "WHERE tag = ? AND title = ? AND attachment = ?" % category)
-        cursor.execute(query, sql_insert)
-        con.commit()
+                "WHERE id = ?", category)
+        if save_edit(temp_file, query, sql_insert):
+            invalidate_cache(tag, category)
+    else:
+        os.remove(temp_file)
 
 
 def move_format_0_entry(org_cat, org_tag, target_cat, target_tag):
-    query = "SELECT description FROM %s WHERE tag = '%s';" % (
-        target_cat, target_tag)
-    cursor.execute(query)
+    query = category_query(
+        "SELECT description FROM %s WHERE tag = ?", target_cat)
+    cursor.execute(query, (target_tag,))
     target_description = cursor.fetchall()
-    query = "SELECT description FROM %s WHERE tag = '%s'" % (org_cat, org_tag)
-    cursor.execute(query)
-    description = cursor.fetchall()[0][0]
+    query = category_query("SELECT description FROM %s WHERE tag = ?", org_cat)
+    cursor.execute(query, (org_tag,))
+    description = cursor.fetchall()
+    if not description:
+        print("The entry doesn't exist anymore, operation canceled.")
+        return
+    description = description[0][0]
     if len(target_description) == 0:
         sql_insert = (target_tag, description)
-        query = "INSERT INTO %s VALUES(?, ?)" % target_cat
+        query = category_query("INSERT INTO %s VALUES(?, ?)", target_cat)
     else:
         # attach description to existing description
         description = target_description[0][0] + '\n' + description
         sql_insert = (description, target_tag)
-        query = "UPDATE %s SET description = ? WHERE tag = ?" % target_cat
+        query = category_query(
+            "UPDATE %s SET description = ? WHERE tag = ?", target_cat)
 
-    cursor.execute(query, sql_insert)
-    con.commit()
-    remove_form_0(org_cat, org_tag)
+    execute_write([
+        (query, sql_insert),
+        (category_query("DELETE FROM %s WHERE tag = ?", org_cat), (org_tag,))])
+    invalidate_cache(target_tag, target_cat)
+    invalidate_cache(org_tag, org_cat)
 
 
 def move_format_1_entry(org_cat, org_tag, org_entry_nr, target_cat, target_tag):
-    query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (
-        org_cat, org_tag)
-    cursor.execute(query)
-    result = cursor.fetchall()
-    posnr = result[org_entry_nr][1]
-    title = result[org_entry_nr][2]
-    description = result[org_entry_nr][3]
+    entry = get_entry(org_cat, org_tag, org_entry_nr)
+    if entry is None:
+        print("The entry doesn't exist anymore, operation canceled.")
+        return
+    entry_id, __, posnr, title, description = entry
     sql_insert = (target_tag, posnr, title, description)
-    query = "INSERT INTO %s VALUES(?, ?, ?, ?)" % target_cat
+    query = category_query(
+        "INSERT INTO %s(tag, posnr, title, description) VALUES(?, ?, ?, ?)",
+        target_cat)
     try:
-        cursor.execute(query, sql_insert)
-        con.commit()
-        remove_form_1(org_cat, org_tag, org_entry_nr)
+        execute_write([
+            (query, sql_insert),
+            (category_query("DELETE FROM %s WHERE id = ?", org_cat),
+             (entry_id,))])
+        invalidate_cache(org_tag, org_cat)
+        invalidate_cache(target_tag, target_cat)
     except sqlite3.IntegrityError:
         print('An identical entry arleady exists, operation canceled.')
 
 
 def move_format_2_entry(org_cat, org_tag, org_entry_nr, target_cat, target_tag):
-    query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (
-        org_cat, org_tag)
-    cursor.execute(query)
-    result = cursor.fetchall()
-    posnr = result[org_entry_nr][1]
-    title = result[org_entry_nr][2]
-    description = result[org_entry_nr][3]
-    attachment = result[org_entry_nr][4]
+    entry = get_entry(org_cat, org_tag, org_entry_nr)
+    if entry is None:
+        print("The entry doesn't exist anymore, operation canceled.")
+        return
+    entry_id, __, posnr, title, description, attachment = entry
     sql_insert = (target_tag, posnr, title, description, attachment)
-    query = "INSERT INTO %s VALUES(?, ?, ?, ?, ?);" % target_cat
+    query = category_query(
+        "INSERT INTO %s(tag, posnr, title, description, attachment) "
+        "VALUES(?, ?, ?, ?, ?)", target_cat)
     try:
-        cursor.execute(query, sql_insert)
-        con.commit()
-        remove_form_2(org_cat, org_tag, org_entry_nr)
+        execute_write([
+            (query, sql_insert),
+            (category_query("DELETE FROM %s WHERE id = ?", org_cat),
+             (entry_id,))])
+        invalidate_cache(org_tag, org_cat)
+        invalidate_cache(target_tag, target_cat)
     except sqlite3.IntegrityError:
         print('An identical entry arleady exists, operation canceled.')
 
 
-def export_results_form_0(category, tag):
+def export_results_form_0(category, tag, result=None):
     """Returns a string for exporting."""
-    query = "SELECT description FROM %s WHERE tag = '%s'" % (category, tag)
-    cursor.execute(query)
-    result = cursor.fetchall()
+    if result is None:
+        query = category_query(
+            "SELECT description FROM %s WHERE tag = ?", category)
+        cursor.execute(query, (tag,))
+        result = cursor.fetchall()
     export = []
     if result:
         result = result[0][0]
@@ -763,11 +1824,10 @@ def export_results_form_0(category, tag):
     return ''.join(export)
 
 
-def export_results_form_1(category, tag):
+def export_results_form_1(category, tag, result=None):
     """Returns a string for exporting with unfolded entries."""
-    query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (category, tag)
-    cursor.execute(query)
-    result = cursor.fetchall()
+    if result is None:
+        result = get_entry_rows(category, tag)
     export = []
     if result:
         export.append('%s:' % category)
@@ -783,11 +1843,10 @@ def export_results_form_1(category, tag):
     return '\n'.join(export)
 
 
-def export_results_form_2(category, tag):
+def export_results_form_2(category, tag, result=None):
     """Returns a string for exporting."""
-    query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (category, tag)
-    cursor.execute(query)
-    result = cursor.fetchall()
+    if result is None:
+        result = get_entry_rows(category, tag)
     export = []
     if result:
         export.append('%s:' % category)
@@ -807,44 +1866,208 @@ def export_results_form_2(category, tag):
 
 def remove_form_0(category, tag):
     """Removes a entry of tag in a category (format 0)."""
-    query = "DELETE FROM %s WHERE tag = '%s';" % (category, tag)
-    cursor.execute(query)
-    con.commit()
+    query = category_query("DELETE FROM %s WHERE tag = ?", category)
+    execute_write([(query, (tag,))])
+    invalidate_cache(tag, category)
 
 
 def remove_form_1(category, tag, entry_nr):
     """Removes a entry with a certain position of tag in a category of
     format 1."""
-    query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (category, tag)
-    cursor.execute(query)
-    result = cursor.fetchall()[entry_nr]
-    *__, posnr, title, description = result
-    sql_insert = (tag, title, description)
-    query = (
-        "DELETE FROM %s "
-        "WHERE tag = ? and title = ? and description = ?" % category)
-    cursor.execute(query, sql_insert)
-    con.commit()
+    entry = get_entry(category, tag, entry_nr)
+    if entry is not None:
+        remove_entry(category, entry[0])
+    invalidate_cache(tag, category)
 
 
 def remove_form_2(category, tag, entry_nr):
     """Removes a entry with a certain position of tag in a category of
     format 2."""
-    query = "SELECT * FROM %s WHERE tag = '%s' ORDER BY posnr" % (category, tag)
-    cursor.execute(query)
-    result = cursor.fetchall()[entry_nr]
-    __, posnr, title, __, attachment = result
-    sql_insert = (tag, title, attachment)
+    entry = get_entry(category, tag, entry_nr)
+    if entry is not None:
+        remove_entry(category, entry[0])
+    invalidate_cache(tag, category)
+
+
+def remove_entry(category, entry_id):
+    """Removes the entry with entry_id of a category with format 1 or 2."""
+    query = category_query("DELETE FROM %s WHERE id = ?", category)
+    execute_write([(query, (entry_id,))])
+
+
+def copy_database(source, target, status=None):
+    """Copies the database of the connection source into the connection target
+    with the sqlite backup API. Pages are copied in steps of BACKUP_PAGES with
+    a pause of BACKUP_THROTTLE seconds in between, so that other connections
+    can still access the database. The progress is written to status."""
+    def progress(__, remaining, total):
+        if status is not None:
+            status['done'] = total - remaining
+            status['total'] = total
+        if remaining and BACKUP_THROTTLE:
+            time.sleep(BACKUP_THROTTLE)
+    source.backup(target, pages=BACKUP_PAGES, progress=progress)
+
+
+def open_incremental_store():
+    """Returns a connection to the content addressed store of incremental
+    backups in BACKUPDIR. Pages of the database are saved once per content in
+    the table chunks, while each snapshot keeps a manifest of the sha256
+    hashes of its pages in order."""
+    store = sqlite3.connect(BACKUPDIR + '/' + INCREMENTAL_STORE)
+    store.execute((
+        "CREATE TABLE IF NOT EXISTS chunks( "
+        "hash BLOB, "
+        "data BLOB, "
+        "PRIMARY KEY(hash))"))
+    store.execute((
+        "CREATE TABLE IF NOT EXISTS snapshots( "
+        "name TEXT, "
+        "created INT, "
+        "page_size INT, "
+        "pages BLOB, "
+        "PRIMARY KEY(name))"))
+    return store
+
+
+def write_incremental_backup(snapshot_file, name):
+    """Splits a consistent copy of the database into pages and saves all pages
+    not yet known to the incremental store compressed. Unchanged pages are
+    only referenced by the manifest of the new snapshot and pages equal to
+    the same page of the latest snapshot aren't even looked up in the store.
+    Returns the size of the snapshot and the checksum of its manifest.
+
+    Disk use grows with the changed pages only, but sqlite doesn't track
+    which pages changed, so the copy is still read and hashed completely and
+    the time of a backup grows with the size of the database."""
+    check = sqlite3.connect(snapshot_file)
+    page_size = check.execute("PRAGMA page_size").fetchone()[0]
+    check.close()
+    store = open_incremental_store()
     query = (
-        "DELETE FROM %s "
-        "WHERE tag = ? and title = ? and attachment = ?" % category)
-    cursor.execute(query, sql_insert)
-    con.commit()
+        "SELECT pages FROM snapshots WHERE page_size = ? "
+        "ORDER BY created DESC LIMIT 1")
+    latest = store.execute(query, (page_size,)).fetchone()
+    latest = latest[0] if latest is not None else b''
+    hashes = []
+    fin = open(snapshot_file, mode='rb')
+    with fin:
+        page = fin.read(page_size)
+        while page:
+            page_hash = hashlib.sha256(page).digest()
+            position = 32 * len(hashes)
+            query = "SELECT 1 FROM chunks WHERE hash = ?"
+            if (latest[position:position+32] != page_hash and
+                    store.execute(query, (page_hash,)).fetchone() is None):
+                sql_insert = (page_hash, zlib.compress(page))
+                store.execute("INSERT INTO chunks VALUES(?, ?)", sql_insert)
+            hashes.append(page_hash)
+            page = fin.read(page_size)
+    pages = b''.join(hashes)
+    sql_insert = (name, int(time.time()), page_size, pages)
+    store.execute(
+        "INSERT OR REPLACE INTO snapshots VALUES(?, ?, ?, ?)", sql_insert)
+    store.commit()
+    store.close()
+    return page_size * len(hashes), hashlib.sha256(pages).hexdigest()
+
+
+def rebuild_incremental_backup(name, fout):
+    """Writes the database of the snapshot name from the incremental store to
+    the file fout."""
+    store = open_incremental_store()
+    query = "SELECT pages FROM snapshots WHERE name = ?"
+    pages = store.execute(query, (name,)).fetchone()
+    if pages is None:
+        store.close()
+        raise sqlite3.DatabaseError("snapshot '%s' does not exist" % name)
+    pages = pages[0]
+    fout = open(fout, mode='wb')
+    with fout:
+        query = "SELECT data FROM chunks WHERE hash = ?"
+        for i in range(0, len(pages), 32):
+            data = store.execute(query, (pages[i:i+32],)).fetchone()
+            if data is not None:
+                data = zlib.decompress(data[0])
+            if data is None or hashlib.sha256(data).digest() != pages[i:i+32]:
+                store.close()
+                raise sqlite3.DatabaseError(
+                    "snapshot '%s' has missing or damaged pages" % name)
+            fout.write(data)
+    store.close()
+
+
+def get_incremental_checksum(name):
+    """Returns the size of a snapshot in the incremental store and the
+    checksum of its manifest or (None, None), if it doesn't exist."""
+    store = open_incremental_store()
+    query = "SELECT page_size, pages FROM snapshots WHERE name = ?"
+    result = store.execute(query, (name,)).fetchone()
+    store.close()
+    if result is None:
+        return None, None
+    page_size, pages = result
+    return page_size * len(pages) // 32, hashlib.sha256(pages).hexdigest()
+
+
+def get_incremental_backups():
+    """Returns [(name, created)] of all snapshots in the incremental
+    store."""
+    if not os.path.exists(BACKUPDIR + '/' + INCREMENTAL_STORE):
+        return []
+    store = open_incremental_store()
+    query = "SELECT name, created FROM snapshots"
+    result = store.execute(query).fetchall()
+    store.close()
+    return result
 
 
-def backup_db(backupname=None):
-    """Performs full backup (a copy) of the pensive database, create
-    backupfolder if not existing and returns the backup file name."""
+def write_backup(fout, status):
+    """Writes a backup of DB to fout with its own database connection, so that
+    it can run in a background thread. The file is compressed with gzip if
+    its name ends with '.gz' and saved as snapshot in the incremental store,
+    if it is located in it. Until the backup is complete, it is written to a
+    '.part' file, which is ignored by restore_db()."""
+    fd, temp_file = tempfile.mkstemp(suffix='.part', dir=BACKUPDIR)
+    os.close(fd)
+    try:
+        source = connect_db(DB)
+        target = sqlite3.connect(temp_file)
+        copy_database(source, target, status)
+        # backups don't depend on a -wal file, even if DB uses WAL
+        target.execute("PRAGMA journal_mode = delete")
+        source.close()
+        target.close()
+        if os.path.dirname(fout) == BACKUPDIR + '/' + INCREMENTAL_STORE:
+            size, checksum = write_incremental_backup(
+                temp_file, os.path.basename(fout))
+            os.remove(temp_file)
+        else:
+            if fout.endswith('.gz'):
+                fin = open(temp_file, mode='rb')
+                with fin, gzip.open(fout, mode='wb') as fgz:
+                    shutil.copyfileobj(fin, fgz)
+                os.remove(temp_file)
+            else:
+                os.replace(temp_file, fout)
+            size = os.path.getsize(fout)
+            checksum = get_file_checksum(fout)
+        add_to_backup_catalog(
+            fout[len(BACKUPDIR) + 1:], time.time(), size, checksum, 'valid')
+    except (sqlite3.Error, OSError) as error:
+        status['error'] = error
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    status['finished'] = True
+
+
+def backup_db(backupname=None, background=False):
+    """Performs a consistent online backup of the pensive database with the
+    sqlite backup API, creates backupfolder if not existing and returns the
+    backup file name. The backup is compressed with gzip, if BACKUP_FORMAT is
+    'gzip', or saved as snapshot in the incremental store, if it is
+    'incremental'. With background=True, the backup is written by a thread and its
+    progress is reported by report_backups()."""
     if not os.path.exists(BACKUPDIR) and not os.path.isdir(BACKUPDIR):
         os.mkdir(BACKUPDIR)
     if backupname is None:
@@ -852,50 +2075,214 @@ def backup_db(backupname=None):
         fout = BACKUPDIR + '/' + timestamp + '.sqlite'
     else:
         fout = BACKUPDIR + '/' + backupname + '.sqlite'
-    shutil.copyfile(DB, fout)
+    if BACKUP_FORMAT == 'gzip':
+        fout += '.gz'
+    elif BACKUP_FORMAT == 'incremental':
+        fout = BACKUPDIR + '/' + INCREMENTAL_STORE + '/' + os.path.basename(
+            fout)[:-len('.sqlite')]
+    status = {'file': fout, 'done': 0, 'total': 0, 'finished': False,
+              'error': None}
+    if background:
+        status['thread'] = threading.Thread(
+            target=write_backup, args=(fout, status))
+        running_backups.append(status)
+        status['thread'].start()
+    else:
+        write_backup(fout, status)
+        if status['error'] is not None:
+            raise status['error']
     return fout
 
 
-def get_reversed_orderd_files_by_modified_time(wd):
-    """Expects a directory and returns a reversed ordered list of its files
-    (newest first)."""
-    files = os.listdir(wd)
-    for i in range(len(files)):
-        date = str(os.path.getmtime(wd + '/' + files[i]))
-        files[i] = date + '|' + files[i]
-    files.sort(reverse=True)
-    files = map(lambda i: i.split('|')[1], files)
-    return files
+def report_backups(show_running=False, wait=False):
+    """Prints the result of finished background backups and, if show_running
+    is True, the progress of running ones. With wait=True, it waits until all
+    running backups are finished."""
+    for status in running_backups[:]:
+        if wait and not status['finished']:
+            print("Waiting for backup '%s' ..." % status['file'])
+            status['thread'].join()
+        if status['finished']:
+            running_backups.remove(status)
+            if status['error'] is None:
+                print("Successfully created '%s'." % status['file'])
+            else:
+                print("%s Backup '%s' failed (%s)." % (
+                    RED + "Error:" + DEL_COLOR, status['file'],
+                    status['error']))
+        elif not show_running:
+            pass
+        elif status['total']:
+            print("Backup '%s' is running: %i%% (%i / %i pages)." % (
+                status['file'], 100 * status['done'] // status['total'],
+                status['done'], status['total']))
+        else:
+            print("Backup '%s' is running." % status['file'])
+
+
+def open_backup(backup_file):
+    """Returns a connection to a backup file and the name of a temporary file,
+    which has to be removed after closing the connection, or None.
+    Compressed backups are decompressed and snapshots of the incremental store
+    are rebuilt to this temporary file first."""
+    if os.path.dirname(backup_file) == BACKUPDIR + '/' + INCREMENTAL_STORE:
+        fd, temp_file = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        try:
+            rebuild_incremental_backup(
+                os.path.basename(backup_file), temp_file)
+        except (sqlite3.Error, zlib.error):
+            os.remove(temp_file)
+            raise
+        return sqlite3.connect(temp_file), temp_file
+    elif backup_file.endswith('.gz'):
+        fd, temp_file = tempfile.mkstemp(suffix='.sqlite')
+        fout = os.fdopen(fd, mode='wb')
+        with fout, gzip.open(backup_file, mode='rb') as fgz:
+            shutil.copyfileobj(fgz, fout)
+        return sqlite3.connect(temp_file), temp_file
+    return sqlite3.connect(backup_file), None
+
+
+def open_backup_catalog():
+    """Returns a connection to the backup catalog in BACKUPDIR, which keeps
+    the creation time, size, checksum and validation status of each
+    backup."""
+    catalog = sqlite3.connect(BACKUPDIR + '/' + BACKUP_CATALOG)
+    catalog.execute((
+        "CREATE TABLE IF NOT EXISTS catalog( "
+        "backup TEXT, "
+        "created REAL, "
+        "size INT, "
+        "checksum TEXT, "
+        "status TEXT, "
+        "PRIMARY KEY(backup))"))
+    return catalog
+
+
+def add_to_backup_catalog(backup, created, size, checksum, status):
+    """Adds or replaces the catalog entry of a backup."""
+    catalog = open_backup_catalog()
+    sql_insert = (backup, created, size, checksum, status)
+    catalog.execute(
+        "INSERT OR REPLACE INTO catalog VALUES(?, ?, ?, ?, ?)", sql_insert)
+    catalog.commit()
+    catalog.close()
+
+
+def get_file_checksum(path):
+    """Returns the sha256 checksum of a file."""
+    checksum = hashlib.sha256()
+    fin = open(path, mode='rb')
+    with fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def probe_backup(file):
+    """Tests a backup file, which is not known by the backup catalog yet, and
+    returns 'unchecked' if it seems valid or 'invalid'."""
+    path = BACKUPDIR + '/' + file
+    try:
+        if file.endswith('.sqlite.gz'):
+            # test the sqlite header only, as decompressing is expensive
+            with gzip.open(path) as fgz:
+                if fgz.read(16) == b'SQLite format 3\x00':
+                    return 'unchecked'
+        else:
+            test_con = sqlite3.connect(path)
+            try:
+                test_con.execute("SELECT catid FROM pensive_conf LIMIT 1")
+                return 'unchecked'
+            finally:
+                test_con.close()
+    except (sqlite3.Error, OSError, EOFError):
+        pass
+    return 'invalid'
 
 
 def get_backups():
-    """Gets all backups from BACKUPDIR and returns valid .sqlite files where
-    the table pensive_conf exists in a list."""
+    """Gets all backups from the backup catalog in BACKUPDIR and returns them
+    in a list [(backup, created)], newest first. Only backups unknown to the
+    catalog are probed and added, entries of removed files are dropped.
+    Known backups are verified by verify_backup() before restoring."""
     if os.path.exists(BACKUPDIR) and os.path.isdir(BACKUPDIR):
-        files = get_reversed_orderd_files_by_modified_time(BACKUPDIR)
+        files = set(os.listdir(BACKUPDIR))
+        catalog = open_backup_catalog()
+        known_backups = set(
+            backup for backup, *__ in catalog.execute(
+                "SELECT backup FROM catalog"))
+        for backup in known_backups:
+            if os.path.dirname(backup) == INCREMENTAL_STORE:
+                removed = INCREMENTAL_STORE not in files
+            else:
+                removed = backup not in files
+            if removed:
+                catalog.execute(
+                    "DELETE FROM catalog WHERE backup = ?", (backup,))
+
         # ensure that only .sqlite files are visible for restore and test them
-        backups = []
-        for file in files:
-            if file.endswith('.sqlite'):
-                try:
-                    test_con = sqlite3.connect(BACKUPDIR + '/' + file)
-                    test_cursor = test_con.cursor()
-                    query = "SELECT * FROM pensive_conf"
-                    test_cursor.execute(query)
-                    test_con.close()
-                    backups.append(file)
-                except:
-                    pass
+        for file in files - known_backups:
+            if file.endswith('.sqlite') or file.endswith('.sqlite.gz'):
+                path = BACKUPDIR + '/' + file
+                sql_insert = (
+                    file, os.path.getmtime(path), os.path.getsize(path),
+                    None, probe_backup(file))
+                catalog.execute(
+                    "INSERT INTO catalog VALUES(?, ?, ?, ?, ?)", sql_insert)
+        if INCREMENTAL_STORE in files:
+            for name, created in get_incremental_backups():
+                backup = INCREMENTAL_STORE + '/' + name
+                if backup not in known_backups:
+                    size, __ = get_incremental_checksum(name)
+                    sql_insert = (backup, created, size, None, 'unchecked')
+                    catalog.execute(
+                        "INSERT INTO catalog VALUES(?, ?, ?, ?, ?)",
+                        sql_insert)
+        catalog.commit()
+        query = (
+            "SELECT backup, created FROM catalog "
+            "WHERE status != 'invalid' ORDER BY created DESC")
+        backups = catalog.execute(query).fetchall()
+        catalog.close()
         return backups
     return None
 
 
+def verify_backup(backup):
+    """Compares a backup with its size and checksum in the backup catalog and
+    saves the result as its status. Backups, whose checksum is unknown, get
+    it recorded at this first check. Returns True for valid backups."""
+    if os.path.dirname(backup) == INCREMENTAL_STORE:
+        size, checksum = get_incremental_checksum(os.path.basename(backup))
+    elif os.path.exists(BACKUPDIR + '/' + backup):
+        size = os.path.getsize(BACKUPDIR + '/' + backup)
+        checksum = get_file_checksum(BACKUPDIR + '/' + backup)
+    else:
+        size, checksum = None, None
+    catalog = open_backup_catalog()
+    query = "SELECT size, checksum FROM catalog WHERE backup = ?"
+    result = catalog.execute(query, (backup,)).fetchone()
+    valid = (
+        result is not None and size == result[0] and
+        (result[1] is None or checksum == result[1]))
+    if valid:
+        sql_insert = (checksum, 'valid', backup)
+    else:
+        sql_insert = (result and result[1], 'invalid', backup)
+    query = "UPDATE catalog SET checksum = ?, status = ? WHERE backup = ?"
+    catalog.execute(query, sql_insert)
+    catalog.commit()
+    catalog.close()
+    return valid
+
+
 def restore_db():
     """Restore the db with existing backups and user input."""
     backups = get_backups()
     if backups:
-        for i, backup in enumerate(backups):
-            mod_time = os.path.getmtime(BACKUPDIR + '/' + backup)
+        for i, (backup, mod_time) in enumerate(backups):
             mod_time = time.gmtime(mod_time)
             mod_time = time.asctime(mod_time)
             if i < 10:
@@ -911,136 +2298,520 @@ def restore_db():
         if cond0 or cond1:
             restore_number = int(restore_number)
             if restore_number >= 0 and restore_number <= len(backups)-1:
-                restore_file = BACKUPDIR + '/' + backups[restore_number]
-                shutil.copyfile(restore_file, DB)
-                global con, cursor
-                con.close()
-                con = sqlite3.connect(DB)
-                cursor = con.cursor()
+                restore_file = BACKUPDIR + '/' + backups[restore_number][0]
+                if not verify_backup(backups[restore_number][0]):
+                    print("%s '%s' doesn't match the backup catalog. "
+                          "Restore canceled." % (
+                              RED + "Error:" + DEL_COLOR, restore_file))
+                    return
+                try:
+                    backup_con, temp_file = open_backup(restore_file)
+                except (sqlite3.Error, zlib.error) as error:
+                    print("%s Can't restore '%s' (%s)." % (
+                        RED + "Error:" + DEL_COLOR, restore_file, error))
+                    return
+                try:
+                    backup_con.execute("SELECT * FROM pensive_conf")
+                    con.commit()
+                    backup_con.backup(con)
+                except sqlite3.DatabaseError as error:
+                    print("%s Can't restore '%s' (%s)." % (
+                        RED + "Error:" + DEL_COLOR, restore_file, error))
+                    return
+                finally:
+                    backup_con.close()
+                    if temp_file is not None:
+                        os.remove(temp_file)
                 get_categories()
                 get_tags()
-                os.system('clear')
+                migrate_db()
+                sync_fulltext_indexes()
+                clear_screen()
                 print("Successfully restored.")
         else:
             print("Invalid input, restore canceled.")
-    elif len(backups) == 0:
+    elif backups is not None:
         print("No valid backups found in '%s'." % BACKUPDIR)
     else:
         print("Backup folder '%s' does not exist." % BACKUPDIR)
 
 
-def export_db():
-    """Exports the pensive database to simple txt files."""
-    # check if export folder exsists
-    if not os.path.exists(EXPORTDIR) and not os.path.isdir(EXPORTDIR):
-        os.mkdir(EXPORTDIR)
+def label_rows(rows, catid):
+    """Yields (tag, catid, row) for rows starting with a tag."""
+    for row in rows:
+        yield row[0], catid, row
 
-    timestamp = str(int(time.time()))
-    os.mkdir(EXPORTDIR + '/' + timestamp)
+
+def iter_tag_exports():
+    """Yields (tag, export) for every defined tag in sorted order. Instead of
+    querying each tag, every category table is streamed once ordered by tag
+    and posnr, and the streams are merged and grouped by tag on the fly."""
+    streams = []
+    for catid, (category, catformatid, __) in enumerate(catconf):
+        if catformatid == 0:
+            query = category_query(
+                "SELECT tag, description FROM %s ORDER BY tag", category)
+        else:
+            query = category_query(
+                "SELECT %s FROM %%s ORDER BY tag, posnr, id" % ', '.join(
+                    ENTRY_COLUMNS[catformatid]), category)
+        streams.append(label_rows(con.execute(query), catid))
+    merged = heapq.merge(*streams, key=lambda item: item[:2])
+    grouped = itertools.groupby(merged, key=lambda item: item[0])
+    current = next(grouped, None)
     for tag in defined_tags:
-        fout = open(EXPORTDIR + '/' + timestamp + '/' + tag, mode='w')
-        with fout:
-            for category, catformatid, __ in catconf:
+        # skip entries of undefined tags
+        while current is not None and current[0] < tag:
+            current = next(grouped, None)
+        export = []
+        if current is not None and current[0] == tag:
+            for catid, items in itertools.groupby(
+                    current[1], key=lambda item: item[1]):
+                category, catformatid, __ = catconf[catid]
+                result = [row for *__, row in items]
                 if catformatid == 0:
-                    export = export_results_form_0(category, tag)
+                    result = [(description,) for __, description in result]
+                    export.append(export_results_form_0(category, tag, result))
                 elif catformatid == 1:
-                    export = export_results_form_1(category, tag)
+                    export.append(export_results_form_1(category, tag, result))
                 elif catformatid == 2:
-                    export = export_results_form_2(category, tag)
-                if export is not None and len(export.split('\n')) > 2:
-                    fout.write(export)
+                    export.append(export_results_form_2(category, tag, result))
+            current = next(grouped, None)
+        yield tag, ''.join(export)
 
 
-def highlight_by_known_tags(line):
-    """Expects a string without '\n', seperates it by ' ' and checks each word,
-    if it appears to be a tag and highlights it blue. """
-    if line is None or line == '':
-        return line
-    words = line.split(' ')
-    new_words = []
-    for word in words:
-        if word == '':
-            new_words.append(word)
-        else:
-            cond0 = word[0] not in ascii_letters
-            cond1 = word[-1] not in ascii_letters
-            if word in defined_tags:
-                new_words.append(BLUE + word + DEL_COLOR)
-
-            # include things like '(tag'
-            elif word[1:] in defined_tags and cond0:
-                new_words.append(word[0] + BLUE + word[1:] + DEL_COLOR)
-
-            # include things like 'tag)'
-            elif word[:-1] in defined_tags and cond1:
-                new_words.append(BLUE + word[:-1] + DEL_COLOR + word[-1])
-
-            # include things like '(tag)'
-            elif word[1:-1] in defined_tags and cond0 and cond1:
-                new_words.append(
-                    word[0] + BLUE + word[1:-1] + DEL_COLOR + word[-1])
-            else:
-                new_words.append(word)
-    return ' '.join(new_words)
-
+def write_export_file(fout, export):
+    """Writes an exported string to the file fout."""
+    fout = open(fout, mode='w')
+    with fout:
+        fout.write(export)
 
-def highlight_by_pattern(line, pattern):
-    """Expects a string and a pattern and returns a red colored string where
-    the pattern matched the string. Therefore the function firstly searches for
-    indezes matching the pattern and stores them in hits als tuples. Secondly
-    the line is highlighted."""
-    start_pos = 0
-    end_pos = len(pattern)
-    hits = []
 
-    while end_pos <= len(line):
-        if line[start_pos:end_pos] == pattern:
-            hits.append((start_pos, end_pos))
-        start_pos += 1
-        end_pos += 1
+def export_db_jsonl(fout):
+    """Exports the pensive database to a single JSON Lines file. Categories
+    and tags are written first, followed by the entries of each category
+    table in a single pass."""
+    fout = open(fout, mode='w')
+    with fout:
+        for category, catformatid, __ in catconf:
+            record = {'type': 'category', 'category': category,
+                      'format': catformatid}
+            fout.write(json.dumps(record) + '\n')
+        for tag in defined_tags:
+            fout.write(json.dumps({'type': 'tag', 'tag': tag}) + '\n')
+        for category, catformatid, __ in catconf:
+            columns = ENTRY_COLUMNS[catformatid]
+            query = category_query(
+                "SELECT %s FROM %%s" % ', '.join(columns), category)
+            if catformatid != 0:
+                query += " ORDER BY tag, posnr, id"
+            for row in con.execute(query):
+                record = {'type': 'entry', 'category': category}
+                record.update(zip(columns, row))
+                fout.write(json.dumps(record) + '\n')
+
+
+def export_db_tar(fout, name):
+    """Exports the pensive database to a gzip compressed tar stream, which
+    contains the text files of export_db() in the directory name."""
+    with tarfile.open(fout, mode='w|gz') as tar:
+        for tag, export in iter_tag_exports():
+            export = export.encode()
+            info = tarfile.TarInfo(name + '/' + tag)
+            info.size = len(export)
+            info.mtime = time.time()
+            tar.addfile(info, io.BytesIO(export))
+
+
+def export_db_sql(fout):
+    """Exports pensive_conf, pensive_tags and all category tables with their
+    indexes and triggers to a SQL dump, which can be read by sqlite3 again.
+    The INSERT statements are quoted by sqlite itself."""
+    fout = open(fout, mode='w')
+    with fout:
+        fout.write('BEGIN TRANSACTION;\n')
+        tables = ['pensive_conf', 'pensive_tags']
+        tables.extend(category for category, *__ in catconf)
+        for table in tables:
+            query = (
+                "SELECT sql FROM sqlite_master "
+                "WHERE type = 'table' AND name = ?")
+            fout.write(con.execute(query, (table,)).fetchone()[0] + ';\n')
+            columns = [
+                "quote(%s)" % column[1] for column in
+                con.execute(category_query("PRAGMA table_info(%s)", table))]
+            query = category_query(
+                "SELECT 'INSERT INTO %s VALUES(' || %s || ');' FROM %%s" % (
+                    quote_identifier(table).replace("'", "''"),
+                    " || ',' || ".join(columns)), table)
+            for insert, in con.execute(query):
+                fout.write(insert + '\n')
+            query = (
+                "SELECT name, sql FROM sqlite_master "
+                "WHERE type IN ('index', 'trigger') AND tbl_name = ? "
+                "AND sql IS NOT NULL")
+            for name, index in con.execute(query, (table,)):
+                # the full text index isn't part of the dump
+                if not name.startswith('%s_fts_' % table):
+                    fout.write(index + ';\n')
+        fout.write('COMMIT;\n')
+
+
+def export_db(export_format=None):
+    """Exports the pensive database in EXPORT_FORMAT or export_format and
+    returns the name of the export. 'txt' creates simple txt files, one per
+    tag, while 'jsonl', 'tar' and 'sql' create a single file. The txt files
+    are written by a pool of EXPORT_THREADS threads, while at most
+    EXPORT_QUEUE exports are kept in memory."""
+    if export_format is None:
+        export_format = EXPORT_FORMAT
+    # check if export folder exsists
+    if not os.path.exists(EXPORTDIR) and not os.path.isdir(EXPORTDIR):
+        os.mkdir(EXPORTDIR)
 
-    pattern = RED + pattern + DEL_COLOR
-    new_line = []
-    for i in range(len(hits)):
+    timestamp = str(int(time.time()))
+    if export_format == 'jsonl':
+        fout = EXPORTDIR + '/' + timestamp + '.jsonl'
+        export_db_jsonl(fout)
+        return fout
+    elif export_format == 'tar':
+        fout = EXPORTDIR + '/' + timestamp + '.tar.gz'
+        export_db_tar(fout, timestamp)
+        return fout
+    elif export_format == 'sql':
+        fout = EXPORTDIR + '/' + timestamp + '.sql'
+        export_db_sql(fout)
+        return fout
 
-        # the first and last match
-        if i == 0 and len(hits) == 1:
-            new_line.append(line[:hits[i][0]] + pattern + line[hits[i][1]:])
+    os.mkdir(EXPORTDIR + '/' + timestamp)
+    queue = threading.BoundedSemaphore(EXPORT_QUEUE)
+    errors = []
+
+    def done(future):
+        if future.exception() is not None:
+            errors.append(future.exception())
+        queue.release()
+
+    with concurrent.futures.ThreadPoolExecutor(EXPORT_THREADS) as pool:
+        for tag, export in iter_tag_exports():
+            queue.acquire()
+            fout = EXPORTDIR + '/' + timestamp + '/' + tag
+            pool.submit(write_export_file, fout, export).add_done_callback(
+                done)
+    if errors:
+        raise errors[0]
+    return EXPORTDIR + '/' + timestamp
+
+
+def parse_export_text(tag, fin):
+    """Parses a text file created by export_db() and yields the tag and its
+    entries as records like export_db_jsonl() writes them. Sections of
+    categories, which are not defined, are skipped."""
+    yield {'type': 'tag', 'tag': tag}
+    formats = dict((category, catformatid) for category, catformatid,
+                   __ in catconf)
+    category = catformatid = entry = None
+    lines = []
+
+    def finish_entry():
+        if catformatid == 0 and lines:
+            return {'type': 'entry', 'category': category, 'tag': tag,
+                    'description': '\n'.join(lines)}
+        elif catformatid == 1 and entry is not None:
+            entry['description'] = '\n'.join(lines)
+            return entry
+        elif catformatid == 2 and entry is not None:
+            return entry
+
+    for line in fin:
+        line = line.rstrip('\n')
+        header = re.match(r' {3,4}\[(\d+)\] (.*)$', line)
+        if line and not line.startswith(' '):
+            # a new category starts
+            record = finish_entry()
+            if record is not None:
+                yield record
+            category = line[:-1]
+            catformatid = formats.get(category)
+            entry = None
+            lines = []
+            if catformatid is None:
+                yield {'type': 'unknown', 'category': category}
+        elif catformatid == 0:
+            lines.append(line[4:])
+        elif catformatid in (1, 2) and header is not None:
+            record = finish_entry()
+            if record is not None:
+                yield record
+            entry = {'type': 'entry', 'category': category, 'tag': tag,
+                     'posnr': int(header.group(1)), 'title': header.group(2)}
+            lines = []
+            if catformatid == 2:
+                title, __, description = header.group(2).partition(' - ')
+                entry.update(title=title, description=description,
+                             attachment='')
+        elif catformatid == 1 and entry is not None and line.startswith(
+                '        '):
+            lines.append(line[8:])
+        elif catformatid == 2 and entry is not None and line.startswith(
+                '        '):
+            entry['attachment'] = line[8:]
+    record = finish_entry()
+    if record is not None:
+        yield record
+
+
+def iter_import_records(path):
+    """Yields the records of an export in any format of export_db()."""
+    if os.path.isdir(path):
+        for tag in sorted(os.listdir(path)):
+            fin = open(path + '/' + tag)
+            with fin:
+                yield from parse_export_text(tag, fin)
+    elif path.endswith('.jsonl'):
+        fin = open(path)
+        with fin:
+            for line in fin:
+                if line.strip():
+                    yield json.loads(line)
+    elif path.endswith('.tar.gz') or path.endswith('.tar'):
+        with tarfile.open(path, mode='r|*') as tar:
+            for member in tar:
+                if member.isfile():
+                    fin = tar.extractfile(member).read().decode()
+                    tag = os.path.basename(member.name)
+                    yield from parse_export_text(
+                        tag, fin.splitlines(keepends=True))
+    elif path.endswith('.sql'):
+        dump = sqlite3.connect(':memory:')
+        fin = open(path)
+        with fin:
+            dump.executescript(fin.read())
+        categories = dump.execute(
+            "SELECT category, catformatid FROM pensive_conf ORDER BY catid")
+        categories = categories.fetchall()
+        for category, catformatid in categories:
+            yield {'type': 'category', 'category': category,
+                   'format': catformatid}
+        for tag, in dump.execute("SELECT tag FROM pensive_tags"):
+            yield {'type': 'tag', 'tag': tag}
+        for category, catformatid in categories:
+            columns = ENTRY_COLUMNS[catformatid]
+            query = category_query(
+                "SELECT %s FROM %%s" % ', '.join(columns), category)
+            for row in dump.execute(query):
+                record = {'type': 'entry', 'category': category}
+                record.update(zip(columns, row))
+                yield record
+        dump.close()
+    else:
+        raise ValueError("unknown export format of '%s'" % path)
+
+
+def import_db(path):
+    """Imports an export of export_db() and returns the number of imported
+    tags and entries. Missing categories of jsonl and sql exports are added,
+    entries are inserted in a single transaction, which has to be rolled back
+    by the caller on errors, and the defined tags and the caches are
+    refreshed at the end. Entries of format 0 are inserted with
+    executemany(), those of format 1 and 2 one by one, so that identical
+    entries rejected by the triggers can be skipped. If IMPORT_FAST is True,
+    sqlite doesn't wait for the data to reach the disk while importing,
+    unless the import is part of a larger transaction like in batch mode,
+    where the setting can't be changed."""
+    commit()
+    fast = IMPORT_FAST and not BATCH_MODE and not con.in_transaction
+    if fast:
+        synchronous = cursor.execute("PRAGMA synchronous").fetchone()[0]
+        cursor.execute("PRAGMA synchronous = OFF")
+    tags = set()
+    entries = {}
+    skipped_categories = set()
+    imported_entries = 0
+
+    def flush(category):
+        catformatid = category_format(category)
+        columns = ENTRY_COLUMNS[catformatid]
+        rows = entries.pop(category)
+        conflict = 'OR IGNORE ' if catformatid == 0 else ''
+        query = category_query(
+            "INSERT %sINTO %%s(%s) VALUES(%s)" % (
+                conflict, ', '.join(columns), ', '.join('?' * len(columns))),
+            category)
+        if catformatid == 0:
+            cursor.executemany(query, rows)
+            # skipped rows aren't counted
+            return cursor.rowcount
+        # a trigger rejects identical entries, which are skipped here
+        imported = 0
+        for row in rows:
+            try:
+                cursor.execute(query, row)
+            except sqlite3.IntegrityError:
+                continue
+            imported += 1
+        return imported
 
-        # the first of some matches
-        elif i == 0 and len(hits) > 1:
-            new_line.append(line[:hits[i][0]] + pattern)
+    try:
+        for record in iter_import_records(path):
+            if record['type'] == 'category':
+                category = record['category']
+                if not category_exists(category):
+                    if record['format'] == 0:
+                        add_category_format0(category)
+                    elif record['format'] == 1:
+                        add_category_format1(category)
+                    elif record['format'] == 2:
+                        add_category_format2(category)
+                elif category_format(category) != record['format']:
+                    skipped_categories.add(category)
+            elif record['type'] == 'tag':
+                tags.add(record['tag'])
+            elif record['type'] == 'unknown':
+                skipped_categories.add(record['category'])
+            elif record['type'] == 'entry':
+                category = record['category']
+                if (category in skipped_categories or
+                        not category_exists(category)):
+                    skipped_categories.add(category)
+                    continue
+                tags.add(record['tag'])
+                columns = ENTRY_COLUMNS[category_format(category)]
+                row = tuple(record[column] for column in columns)
+                entries.setdefault(category, []).append(row)
+                if len(entries[category]) >= IMPORT_BATCH:
+                    imported_entries += flush(category)
+        for category in list(entries):
+            imported_entries += flush(category)
+        new_tags = sorted(tags - defined_tags.tags)
+        cursor.executemany(
+            "INSERT INTO pensive_tags(tag) VALUES(?)",
+            [(tag,) for tag in new_tags])
+        commit()
+    except Exception:
+        # the setting can only be restored outside of the transaction
+        if fast:
+            con.rollback()
+        raise
+    finally:
+        if fast:
+            cursor.execute("PRAGMA synchronous = %i" % synchronous)
+    defined_tags.update(new_tags)
+    invalidate_cache()
+    for category in sorted(skipped_categories):
+        print("Skipped entries of '%s': category is not defined or has "
+              "another format." % category)
+    return len(new_tags), imported_entries
 
-        # another match, but not the last one
-        elif i > 0 and i != len(hits)-1:
-            new_line.append(line[hits[i-1][1]:hits[i][0]] + pattern)
 
-        # the last of serveral matches
-        elif i > 0 and i == len(hits)-1:
-            new_line.append(
-                line[hits[i-1][1]:hits[i][0]] + pattern + line[hits[i][1]:])
-    return ''.join(new_line)
+def highlight_by_known_tags(line):
+    """Expects a string without newlines and highlights all defined tags in it
+    blue, which are not part of a longer word, like '(tag)', 'tag,' or
+    'python.sqlite3'."""
+    if line is None or line == '':
+        return line
+    matches = defined_tags.matcher().find(line)
+    if not matches:
+        return line
+    parts = []
+    position = 0
+    for start, end in matches:
+        parts.append(line[position:start])
+        parts.append(BLUE + line[start:end] + DEL_COLOR)
+        position = end
+    parts.append(line[position:])
+    return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=32)
+def compile_patterns(patterns, ignore_case=False):
+    """Compiles a tuple of patterns into one regular expression. Longer
+    patterns are tried first, so that a shorter one never cuts a longer match
+    at the same position."""
+    patterns = sorted(set(patterns), key=len, reverse=True)
+    flags = re.IGNORECASE if ignore_case else 0
+    return re.compile('|'.join(map(re.escape, patterns)), flags)
+
+
+def highlight_by_pattern(line, pattern, ignore_case=False):
+    """Expects a string and a pattern or a list of patterns and returns a red
+    colored string where the patterns matched the string. All patterns are
+    highlighted in one linear pass, overlapping matches are skipped."""
+    if isinstance(pattern, str):
+        pattern = (pattern,)
+    patterns = tuple(p for p in pattern if p)
+    if not patterns:
+        return line
+    regex = compile_patterns(patterns, ignore_case)
+    return regex.sub(RED + r'\g<0>' + DEL_COLOR, line)
+
+
+def search_fulltext_index(pattern):
+    """Searches the FTS5 shadow indexes of all categories for pattern (not case
+    sensitive) with a single query. Results are ranked by bm25 and returned
+    like search_everything() does, while snippets and highlighting are
+    extracted by sqlite. Like there, the snippet is always taken from the
+    description and attachments aren't searched."""
+    selects = []
+    for catid, (category, catformatid, __) in enumerate(catconf):
+        fts = quote_identifier('%s_fts' % category)
+        if catformatid == 0:
+            title = "''"
+            snippet = "snippet(%s, 1, ?, ?, '...', 48)" % fts
+        else:
+            title = "highlight(%s, 1, ?, ?)" % fts
+            snippet = "snippet(%s, 2, ?, ?, '...', 48)" % fts
+        match = '?'
+        if catformatid == 2:
+            match = "'{title description} : ' || ?"
+        selects.append((
+            "SELECT tag, %i, %s, replace(%s, char(10), ' '), bm25(%s) "
+            "FROM %s WHERE %s MATCH %s" % (
+                catid, title, snippet, fts, fts, fts, match)))
+    result = dict()
+    if not selects:
+        return result
+    phrase = '"%s"' % pattern.replace('"', '""')
+    sql_insert = []
+    for category, catformatid, __ in catconf:
+        if catformatid != 0:
+            sql_insert.extend((RED, DEL_COLOR))
+        sql_insert.extend((RED, DEL_COLOR, phrase))
+    query = ' UNION ALL '.join(selects) + ' ORDER BY 5'
+    cursor.execute(query, sql_insert)
+    for tag, catid, title, line, __ in cursor.fetchall():
+        category = catconf[catid][0]
+        if tag not in result:
+            result[tag] = [(category, title, line)]
+        else:
+            result[tag].append((category, title, line))
+    return result
 
 
 def search_everything(pattern):
     """Seaches the complete pensive database (except attachments) for pattern
-    (not case sensitive) and returns a dictionary with additional, case
-    sensitive highlighting."""
+    (not case sensitive) and returns a dictionary with additional
+    highlighting. If the FTS5 shadow indexes are enabled, they are
+    used instead for patterns of at least three characters."""
+    if FULLTEXT_ENABLED and len(pattern) >= 3:
+        return search_fulltext_index(pattern)
     pattern_sql = '%' + pattern + '%'
+    regex = compile_patterns((pattern,), True)
     result = dict()
     for category, catformatid, __ in catconf:
         if catformatid == 0:
-            query = "SELECT * FROM %s WHERE description LIKE ?" % category
+            query = category_query(
+                "SELECT * FROM %s WHERE description LIKE ?", category)
             cursor.execute(query, (pattern_sql,))
             query_result = cursor.fetchall()
             for tag, description in query_result:
                 hits = []
                 lines = description.split('\n')
 
-                # highlight case sensitive matches or use the 1st line instead
+                # highlight matches or use the 1st line instead
                 for line in lines:
-                    if pattern in line:
-                        colored_line = highlight_by_pattern(line, pattern)
+                    if regex.search(line):
+                        colored_line = highlight_by_pattern(line, pattern, True)
                         hits.append(colored_line)
                 if not hits:
                     hits.append(lines[0])
@@ -1054,27 +2825,27 @@ def search_everything(pattern):
 
         elif catformatid == 1 or catformatid == 2:
             sql_insert = (pattern_sql, pattern_sql)
-            query = (
-                "SELECT * FROM %s "
+            query = category_query(
+                "SELECT tag, posnr, title, description FROM %s "
                 "WHERE title LIKE ? OR description LIKE ? "
-                "ORDER BY posnr;" % category)
+                "ORDER BY posnr, id", category)
             cursor.execute(query, sql_insert)
             query_result = cursor.fetchall()
             for tag, _, title, description, *__ in query_result:
                 hits = []
                 lines = description.split('\n')
 
-                # highlight case sensitive matches or use the 1st line instead
+                # highlight matches or use the 1st line instead
                 for line in lines:
-                    if pattern in line:
-                        colored_line = highlight_by_pattern(line, pattern)
+                    if regex.search(line):
+                        colored_line = highlight_by_pattern(line, pattern, True)
                         hits.append(colored_line)
                 if not hits:
                     hits.append(lines[0])
 
                 # highlight title if possible
-                if pattern in title:
-                    title = highlight_by_pattern(title, pattern)
+                if regex.search(title):
+                    title = highlight_by_pattern(title, pattern, True)
 
                 # add formatted hits to result
                 for line in hits:
@@ -1082,14 +2853,14 @@ def search_everything(pattern):
                         result[tag] = [(category, title, line)]
                     else:
                         result[tag].append((category, title, line))
-    return result
+    return dict(sorted(result.items()))
 
 
 def display_search_everything(pattern):
     """Print results of search_everything()."""
     result = search_everything(pattern)
     if result:
-        # get longest cat and tag name, sort tags
+        # get longest cat and tag name
         tags = []
         len_tags = []
         len_cats = []
@@ -1100,7 +2871,6 @@ def display_search_everything(pattern):
             for category, *__ in result[tag]:
                 len_cats.append(len(category))
 
-        tags.sort()
         max_cat_length = max(len_cats)
         max_tag_length = max(len_tags)
 
@@ -1132,7 +2902,8 @@ def install_pensive_base():
         "CREATE TABLE pensive_tags( "
         "tag TEXT, "
         "PRIMARY KEY(tag))"))
-    con.commit()
+    cursor.execute("PRAGMA user_version = %i" % SCHEMA_VERSION)
+    commit()
     get_categories()
 
 
@@ -1160,9 +2931,8 @@ def install_pensive_examples():
         "pacman -Su             system update\n"
         "pacman -Qs [package]   query search\n"
         "...")
-    query = "INSERT INTO %s VALUES('%s', '%s');" % (
-        category, tag, form_0_insert)
-    cursor.execute(query)
+    query = category_query("INSERT INTO %s VALUES(?, ?)", category)
+    cursor.execute(query, (tag, form_0_insert))
 
     # insert form 1 examples
     category = 'form_1_example'
@@ -1176,16 +2946,17 @@ def install_pensive_examples():
                 ".lower()        returns string in lower case letters\n"
                 ".upper()        returns string in upper case letters\n"
                 ".find(pattern)  returns the first index position of pattern\n"
-                ".strip()        removes ''\\n'' of lines\n"
+                ".strip()        removes '\\n' of lines\n"
                 ".replace()      ...\n"
                 ".capitalize()   ...\n"
                 ".split(sep)     ...\n"
                 "...")
         else:
             desc = 'blah %s' % str(i)
-        query = "INSERT INTO %s VALUES('%s', %s, '%s', '%s')" % (
-            category, tag, posnr, title, desc)
-        cursor.execute(query)
+        query = category_query(
+            "INSERT INTO %s(tag, posnr, title, description) "
+            "VALUES(?, ?, ?, ?)", category)
+        cursor.execute(query, (tag, posnr, title, desc))
 
     # insert form 2 examples
     category = 'form_2_example'
@@ -1197,26 +2968,29 @@ def install_pensive_examples():
         ('Not existing python tag', '', 'python.tkinter')]
 
     for i, (title, description, attachment) in enumerate(insert):
-        query = "INSERT INTO %s VALUES('%s', %s, '%s', '%s', '%s');" % (
-            category, tag, i, title, description, attachment)
-        cursor.execute(query)
-    con.commit()
+        query = category_query(
+            "INSERT INTO %s(tag, posnr, title, description, attachment) "
+            "VALUES(?, ?, ?, ?, ?)", category)
+        cursor.execute(query, (tag, i, title, description, attachment))
+    commit()
 
 
 def uninstall_pensive_examples():
     """Removes everything and installs pensive_base once more."""
+    for category in ('form_0_example', 'form_1_example', 'form_2_example'):
+        drop_fulltext_index(category)
     cursor.execute("DROP TABLE form_0_example")
     cursor.execute("DROP TABLE form_1_example")
     cursor.execute("DROP TABLE form_2_example")
     cursor.execute("DROP TABLE pensive_tags")
     cursor.execute("DROP TABLE pensive_conf")
-    con.commit()
+    commit()
 
 
 def do_tutorial():
     """Intruduces pensive in seven steps."""
     install_pensive_examples()
-    os.system('clear')
+    clear_screen()
     print("""[Tutorial page 1 / 7]
     Welcome to pensive, a tool for organizing information by command line.
     Organizing means here to view, edit or remove information without leaving
@@ -1228,7 +3002,7 @@ def do_tutorial():
     Format 1: Separate entries, which can be unfolded, e.g. some scripts
     Format 2: Attachments, e.g. URLs, files or other tags""")
     __ = input('\n[Please press any key to proceed]\n')
-    os.system('clear')
+    clear_screen()
 
     print("""[Tutorial page 2 / 7]
     Format 0 displays information as it is - with the exception of highlighting
@@ -1237,7 +3011,7 @@ def do_tutorial():
     like pacman immediately at once:\n""")
     show_results_form_0('form_0_example', 'pacman')
     __ = input('\n[Please press any key to proceed]\n')
-    os.system('clear')
+    clear_screen()
 
     print("""[Tutorial page 3 / 7]
     Format 1 displays grouped information by titles. The idea is that there
@@ -1248,7 +3022,7 @@ def do_tutorial():
     print('... and here is an unfolded entry:\n')
     show_single_entry_form_1('form_1_example', 'python', 0)
     __ = input('\n[Please press any key to proceed]\n')
-    os.system('clear')
+    clear_screen()
 
     print("""[Tutorial page 4 / 7]
     Format 2 is similar to format 1. The big difference is, that you can specify
@@ -1264,7 +3038,7 @@ def do_tutorial():
     look at the output of the query of 'python' would show us."""
     )
     __ = input('\n[Please press any key to proceed]\n')
-    os.system('clear')
+    clear_screen()
 
     print("[Tutorial page 5 / 7]")
     display_overview('python')
@@ -1290,7 +3064,7 @@ def do_tutorial():
     """
     )
     __ = input('\n[Please press any key to proceed]\n')
-    os.system('clear')
+    clear_screen()
 
     print("[Tutorial page 6 / 7]")
     display_help()
@@ -1298,7 +3072,7 @@ def do_tutorial():
     uninstall_pensive_examples()
     install_pensive_base()
     get_tags()
-    os.system('clear')
+    clear_screen()
 
     print("""[Tutorial page 7 / 7]
     Now you can try to add some categories on your own. The syntax is:
@@ -1330,6 +3104,13 @@ def category_exists(category):
     return False
 
 
+def category_format(category):
+    """Expects a defined category and returns its format."""
+    for defined_category, catformatid, __ in catconf:
+        if defined_category == category:
+            return catformatid
+
+
 def entry_exists(catid, entry_nr):
     """Expects category id and an entry number and checks, if suchs an
     entry exists."""
@@ -1337,7 +3118,10 @@ def entry_exists(catid, entry_nr):
 
 
 def ask_yes_no(name, mode):
-    """Asks a yes no question and returns the True or False."""
+    """Asks a yes no question and returns the True or False. In batch mode,
+    every question is answered with yes."""
+    if BATCH_MODE:
+        return True
     if mode == 0:
         question = "Do you realy want to remove everything of '%s'?" % name
     elif mode == 1:
@@ -1351,99 +3135,161 @@ def ask_yes_no(name, mode):
         return False
 
 
-def pensive_shell(active_tag=None):
-    """Central command line interface. Sometimes the function returns itself
-    without an active tag (mostly 'basic functions' as they are named in the
-    help view), but generally, it returns a active tag, if possible."""
-    # prompt handling
-    prompt = ':'
-    if active_tag is not None:
-        prompt = '[%s]:' % active_tag
-        uin = input(prompt)
-    else:
-        uin = input(prompt)
+def get_catid(catletter):
+    """Expects an upper case letter and returns the id of the aliased
+    category or None."""
+    if catletter and catid_exists(catletter):
+        return ord(catletter)-65
+    return None
+
 
-    # input handling
-    if uin == 'license':
-        display_license()
-        return pensive_shell()
+def shell_unknown(uin, active_tag):
+    """Displays the help for unknown or incomplete commands."""
+    display_help()
+    return active_tag
 
-    elif uin == 'help':
-        display_help()
-        return pensive_shell()
 
-    elif uin == 'ls':
+def shell_license(uin, active_tag):
+    if uin != 'license':
+        return shell_unknown(uin, active_tag)
+    display_license()
+    return None
+
+
+def shell_help(uin, active_tag):
+    display_help()
+    return None
+
+
+def shell_ls(uin, active_tag):
+    if uin == 'ls':
         # list all tags
         display_tags()
-        return pensive_shell()
-
-    elif uin.startswith('ls '):
+    elif '*' in uin[3:] or '?' in uin[3:] or '[' in uin[3:]:
         # list tags matching input
-        if '*' in uin[3:]:
-            display_specific_tags(uin[3:])
-        else:
-            display_specific_tags(uin[3:] + '*')
-        return pensive_shell()
+        display_specific_tags(uin[3:])
+    else:
+        display_specific_tags(uin[3:] + '*')
+    return None
 
-    elif uin.startswith('add '):
-        # add one or more tags to pensive
-        tags = uin[4:].split(' ')
-        added_tags = []
-        for tag in tags:
-            if tag not in defined_tags:
-                add_tag_to_db(tag)
-                added_tags.append(tag)
-        if len(added_tags) == 0:
-            print("Tag(s) already defined. You can query tags by '?tag'.")
-            return pensive_shell()
-        elif len(added_tags) == 1:
-            os.system('clear')
-            display_overview(added_tags[0])
-            return pensive_shell(added_tags[0])
-        elif len(added_tags) > 1:
-            print('%d tags added.' % len(added_tags))
-            return pensive_shell()
-
-    elif uin.startswith('rm '):
-        # remove one or more tags from pensive
-        tags = uin[3:].split(' ')
-        removed_tags = []
-        for tag in tags:
-            if tag in defined_tags:
-                remove_tag_from_db(tag)
-                removed_tags.append(tag)
-        if len(removed_tags) == 0:
-            print("Tag(s) not defined, nothing to remove.")
-        elif len(removed_tags) > 1:
-            print('%s tags removed.' % len(removed_tags))
-        return pensive_shell()
-
-    elif uin.startswith('mv ') and active_tag is None:
+
+def shell_add(uin, active_tag):
+    # add one or more tags to pensive
+    if not uin.startswith('add '):
+        return shell_unknown(uin, active_tag)
+    added_tags = add_tags_to_db(uin[4:].split(' '))
+    if len(added_tags) == 0:
+        print("Tag(s) already defined. You can query tags by '?tag'.")
+        return None
+    elif len(added_tags) == 1:
+        clear_screen()
+        display_overview(added_tags[0])
+        return added_tags[0]
+    print('%d tags added.' % len(added_tags))
+    return None
+
+
+def shell_rm(uin, active_tag):
+    # remove one or more tags from pensive
+    if not uin.startswith('rm '):
+        return shell_unknown(uin, active_tag)
+    tags = uin[3:].split(' ')
+    removed_tags = []
+    for tag in tags:
+        if tag in defined_tags:
+            remove_tag_from_db(tag)
+            removed_tags.append(tag)
+    if len(removed_tags) == 0:
+        print("Tag(s) not defined, nothing to remove.")
+    elif len(removed_tags) > 1:
+        print('%s tags removed.' % len(removed_tags))
+    return None
+
+
+def shell_mv(uin, active_tag):
+    move_request = uin.split(' ')[1:]
+    if len(move_request) != 2:
+        return shell_unknown(uin, active_tag)
+    if active_tag is None:
         # rename tag
-        old_tag_name = uin[3:].split(' ')[0]
-        new_tag_name = uin[3:].split(' ')[1]
-        rename_tag(old_tag_name, new_tag_name)
-        return pensive_shell()
+        rename_tag(move_request[0], move_request[1])
+        return None
+    if get_catid(move_request[0][:1]) is None:
+        return shell_unknown(uin, active_tag)
+
+    # move single entries between categories and or tags
+    if get_catid(move_request[1][:1]) is not None:
+        org_tag = active_tag
+        org_catid = ord(move_request[0][0])-65
+        org_category = catconf[(ord(move_request[0][0])-65)][0]
+        org_catformatid = catconf[(ord(move_request[0][0])-65)][1]
+        if len(move_request[0]) > 1:
+            try:
+                org_entry_nr = int(move_request[0][1:])
+            except ValueError:
+                print("You can move tags in non tag mode only!")
+                return active_tag
+        else:
+            org_entry_nr = None
 
-    elif uin.startswith('?') and len(uin) > 1 and uin[1] != '?':
-        # query a tag
-        os.system('clear')
-        if uin[1:] in defined_tags:
-            display_overview(uin[1:])
-            return pensive_shell(uin[1:])
+        if '@' not in move_request[1]:
+            target_tag = active_tag
         else:
+            target_tag = move_request[1].split('@')[1]
+        target_category = catconf[(ord(move_request[1][0])-65)][0]
+        target_catformatid = catconf[(ord(move_request[1][0])-65)][1]
+
+        if target_tag not in defined_tags:
+            if not ask_yes_no(target_tag, 2):
+                return active_tag
+            else:
+                add_tag_to_db(target_tag)
+        if target_catformatid != org_catformatid:
             print((
-                "Tag '%s' is not defined yet. "
-                "How about adding it with 'add %s'?" % (uin[1:], uin[1:])))
-            return pensive_shell()
+                "Categories don't exist or don't share same format. "
+                "Operation cancelled."))
+            return active_tag
+        if target_catformatid == 0 and tag_results[org_catid][2] != 0:
+            args = (org_category, org_tag, target_category, target_tag)
+            move_format_0_entry(*args)
+        elif (target_catformatid == 1 and org_entry_nr is not None and
+                entry_exists(org_catid, org_entry_nr)):
+            args = (
+                org_category, org_tag, org_entry_nr,
+                target_category, target_tag)
+            move_format_1_entry(*args)
+        elif (target_catformatid == 2 and org_entry_nr is not None and
+                entry_exists(org_catid, org_entry_nr)):
+            args = (
+                org_category, org_tag, org_entry_nr,
+                target_category, target_tag)
+            move_format_2_entry(*args)
+        clear_screen()
+        display_overview(active_tag)
+    return active_tag
+
+
+def shell_query(uin, active_tag):
+    # query a tag
+    clear_screen()
+    if uin[1:] in defined_tags:
+        display_overview(uin[1:])
+        return uin[1:]
+    print((
+        "Tag '%s' is not defined yet. "
+        "How about adding it with 'add %s'?" % (uin[1:], uin[1:])))
+    return None
 
-    elif uin.startswith('??') and len(uin) > 2:
-        # start a flull text search with a pattern
-        os.system('clear')
-        display_search_everything(uin[2:])
-        return pensive_shell()
 
-    elif uin == 'category show':
+def shell_search(uin, active_tag):
+    # start a flull text search with a pattern
+    clear_screen()
+    display_search_everything(uin[2:])
+    return None
+
+
+def shell_category(uin, active_tag):
+    if uin == 'category show':
         # show all defined categories
         display_categories()
 
@@ -1479,187 +3325,403 @@ def pensive_shell(active_tag=None):
         new_category = uin[12:].split(' ')[1]
         if category_exists(old_category) and not category_exists(new_category):
             rename_category(old_category, new_category)
+    else:
+        return shell_unknown(uin, active_tag)
+    return active_tag
 
-    elif uin.startswith('backup'):
-        if len(uin) == 6:
-            fout = backup_db()
-        elif ' ' in uin and len(uin) > 7:
-            backupname = uin[7:]
-            fout = backup_db(backupname)
+
+def shell_backup(uin, active_tag):
+    if uin == 'backup status':
+        if running_backups:
+            report_backups(show_running=True)
+        else:
+            print('No backup is running.')
+        return active_tag
+    elif uin == 'backup':
+        backupname = None
+    elif len(uin) > 7:
+        backupname = uin[7:]
+    else:
+        return shell_unknown(uin, active_tag)
+    if BATCH_MODE:
+        fout = backup_db(backupname)
         print("Successfully created '%s'." % fout)
+    else:
+        fout = backup_db(backupname, background=True)
+        print("Creating '%s' in the background." % fout)
+    return active_tag
 
-    elif uin.startswith('restore'):
-        restore_db()
 
-    elif uin.startswith('export'):
-        export_db()
-        print('Done.')
+def shell_restore(uin, active_tag):
+    restore_db()
+    return active_tag
 
-    elif uin == 'q' or uin == 'quit':
-        con.close()
-        return sys.exit()
 
-    elif active_tag is not None and len(uin) == 1 and catid_exists(uin[0]):
-        # show results of only one category
-        os.system('clear')
-        catformatid = catconf[(ord(uin[0])-65)][1]
-        category = catconf[(ord(uin[0])-65)][0]
+def shell_export(uin, active_tag):
+    if uin == 'export':
+        fout = export_db()
+    elif uin[7:] in EXPORT_FORMATS:
+        fout = export_db(uin[7:])
+    else:
+        return shell_unknown(uin, active_tag)
+    print("Successfully exported to '%s'." % fout)
+    return active_tag
+
+
+def shell_import(uin, active_tag):
+    if not uin.startswith('import '):
+        return shell_unknown(uin, active_tag)
+    path = uin[7:]
+    if not os.path.exists(path):
+        print("'%s' does not exist." % path)
+        return active_tag
+    try:
+        tags, entries = import_db(path)
+    except (
+            ValueError, KeyError, OSError, tarfile.TarError,
+            sqlite3.Error) as error:
+        if BATCH_MODE:
+            raise
+        con.rollback()
+        print("%s Can't import '%s' (%s). Nothing changed." % (
+            RED + "Error:" + DEL_COLOR, path, error))
+        return active_tag
+    print('%d tags and %d entries imported.' % (tags, entries))
+    return active_tag
+
+
+def shell_check(uin, active_tag):
+    if uin != 'check':
+        return shell_unknown(uin, active_tag)
+    broken, counts = check_all_attachments()
+    with paged_output():
+        for tag, category, entry_nr, title, attachment, reason in broken:
+            print('[%s] %s [%i] %s: %s (%s)' % (
+                tag, category, entry_nr, title,
+                RED + attachment + DEL_COLOR, reason))
+        if URL_CHECK_ENDPOINT:
+            checked = '%i URLs' % counts['URL']
+        else:
+            checked = '%i URLs (skipped, URL_CHECK_ENDPOINT is not set)' % (
+                counts['URL'])
+        print('Checked %i files, %i tags and %s: %i broken attachments.' % (
+            counts['File'], counts['Tag'], checked, len(broken)))
+    return active_tag
+
+
+def shell_stats(uin, active_tag):
+    if uin != 'stats':
+        return shell_unknown(uin, active_tag)
+    print('storage:')
+    for pragma, value in get_storage_profile():
+        print('    %-13s %s' % (pragma, value))
+    print('    %-13s %s' % ('filesystem', get_filesystem(DB) or 'unknown'))
+    print('caches:')
+    for name, cache in (('overview', overview_cache), ('block', block_cache)):
+        print('    %-8s %6i hits %6i misses %4i / %i entries' % (
+            name, cache_stats[name + ' hits'], cache_stats[name + ' misses'],
+            len(cache), OVERVIEW_CACHE_SIZE))
+    return active_tag
+
+
+def benchmark_read_path(tag, pattern):
+    """Measures display_overview(tag) and search_everything(pattern) without
+    and with memory mapped I/O and returns [(mmap_size, overview seconds,
+    search seconds)] with the median of BENCHMARK_RUNS runs each. Every run
+    uses a new connection and empty caches, so that pages are read from the
+    file again instead of sqlite's page cache."""
+    global con, cursor
+    main_connection = con, cursor
+    results = []
+    try:
+        for mmap_size in sorted({0, get_mmap_size(DB)}):
+            overview_times = []
+            search_times = []
+            for __ in range(BENCHMARK_RUNS):
+                con = connect_db(DB)
+                con.execute("PRAGMA mmap_size = %i" % mmap_size)
+                cursor = con.cursor()
+                invalidate_cache()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    display_overview(tag)
+                    overview_times.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    search_everything(pattern)
+                    search_times.append(time.perf_counter() - start)
+                con.close()
+            results.append((
+                mmap_size, statistics.median(overview_times),
+                statistics.median(search_times)))
+    finally:
+        con, cursor = main_connection
+        invalidate_cache()
+    return results
+
+
+def shell_benchmark(uin, active_tag):
+    if uin == 'benchmark' and active_tag is not None:
         tag = active_tag
-        if catformatid == 0:
-            show_results_form_0(category, tag)
-        elif catformatid == 1:
-            show_results_form_1(category, tag)
-        elif catformatid == 2:
-            show_results_form_2(category, tag)
+    elif uin.startswith('benchmark ') and uin[10:] in defined_tags:
+        tag = uin[10:]
+    else:
+        return shell_unknown(uin, active_tag)
+    print("Benchmarking '?%s' and '??%s' (median of %i runs):" % (
+        tag, tag, BENCHMARK_RUNS))
+    for mmap_size, overview_time, search_time in benchmark_read_path(
+            tag, tag):
+        print('    mmap_size %10i: overview %8.2f ms, search %8.2f ms' % (
+            mmap_size, overview_time * 1000, search_time * 1000))
+    if active_tag is not None:
+        get_overview(active_tag)
+    return active_tag
 
-    elif active_tag is not None and len(uin) >= 1 and catid_exists(uin[0]) and uin[1] in digits:
+
+def shell_quit(uin, active_tag):
+    if uin != 'q' and uin != 'quit':
+        return shell_unknown(uin, active_tag)
+    report_backups(wait=True)
+    con.close()
+    sys.exit()
+
+
+def shell_category_letter(uin, active_tag):
+    catid = get_catid(uin[0])
+    if active_tag is None or catid is None:
+        return shell_unknown(uin, active_tag)
+    category, catformatid, __ = catconf[catid]
+    tag = active_tag
+    if len(uin) == 1:
+        # show results of only one category
+        clear_screen()
+        result = get_overview_rows(category, tag)
+        with paged_output():
+            if result is None:
+                if catformatid == 0:
+                    show_results_form_0(category, tag)
+                elif catformatid == 1:
+                    show_results_form_1(category, tag)
+                elif catformatid == 2:
+                    show_results_form_2(category, tag)
+            else:
+                show_block(category, catformatid, tag, result)
+    elif uin[1:].isdigit():
         # show singe entry form 1 or open attachment of form 2
-        catformatid = catconf[(ord(uin[0])-65)][1]
         entry_nr = int(uin[1:])
-        category = catconf[(ord(uin[0])-65)][0]
-        tag = active_tag
-        catid = ord(uin[0])-65
         if catformatid == 1 and entry_exists(catid, entry_nr):
-            show_single_entry_form_1(category, tag, entry_nr)
+            with paged_output():
+                show_single_entry_form_1(category, tag, entry_nr)
         elif catformatid == 2 and entry_exists(catid, entry_nr):
-            open_attachment_form_2(category, tag, entry_nr)
+            return open_attachment_form_2(category, tag, entry_nr)
         else:
-            os.system('clear')
+            clear_screen()
             display_overview(tag)
+    else:
+        return shell_unknown(uin, active_tag)
+    return active_tag
+
+
+def shell_edit(uin, active_tag):
+    # edit or create entries of all kind
+    catid = get_catid(uin[1:2])
+    if active_tag is None or catid is None:
+        return shell_unknown(uin, active_tag)
+    category, catformatid, __ = catconf[catid]
+    tag = active_tag
+    entry_nr = None
+    if uin[2:].isdigit() and entry_exists(catid, int(uin[2:])):
+        entry_nr = int(uin[2:])
+    try:
+        if catformatid == 0:
+            edit_and_update_form_0(category, tag)
+        elif catformatid == 1:
+            edit_and_update_form_1(category, tag, entry_nr)
+        elif catformatid == 2:
+            edit_and_update_form_2(category, tag, entry_nr)
+        clear_screen()
+        display_overview(tag=active_tag)
+    except sqlite3.IntegrityError:
+        print('An identical entry arleady exists, operation canceled.')
+    return active_tag
 
-    elif active_tag is not None and uin.startswith('*') and catid_exists(uin[1]):
-        # edit or create entries of all kind
-        catformatid = catconf[(ord(uin[1])-65)][1]
-        category = catconf[(ord(uin[1])-65)][0]
-        catid = ord(uin[1])-65
+
+def shell_remove_entry(uin, active_tag):
+    # remove single entries
+    catid = get_catid(uin[1:2])
+    if active_tag is None or catid is None:
+        return shell_unknown(uin, active_tag)
+    if ask_yes_no(name=uin[1:], mode=1):
+        category, catformatid, __ = catconf[catid]
         tag = active_tag
-        try:
-            if catformatid == 0:
-                edit_and_update_form_0(category, tag)
-            elif catformatid == 1:
-                if len(uin) > 2 and entry_exists(catid, int(uin[2:])):
-                    entry_nr = int(uin[2:])
-                    edit_and_update_form_1(category, tag, entry_nr)
-                else:
-                    edit_and_update_form_1(category, tag)
-            elif catformatid == 2:
-                if len(uin) > 2 and entry_exists(catid, int(uin[2:])):
-                    entry_nr = int(uin[2:])
-                    edit_and_update_form_2(category, tag, entry_nr)
-                else:
-                    edit_and_update_form_2(category, tag)
-            os.system('clear')
-            display_overview(tag=active_tag)
-        except sqlite3.IntegrityError:
-            print('An identical entry arleady exists, operation canceled.')
-
-    elif active_tag is not None and uin.startswith('-') and catid_exists(uin[1]):
-        # remove single entries
-        if ask_yes_no(name=uin[1:], mode=1):
-            catformatid = catconf[(ord(uin[1])-65)][1]
-            category = catconf[(ord(uin[1])-65)][0]
-            catid = ord(uin[1])-65
-            tag = active_tag
-            if catformatid == 0:
-                remove_form_0(category, tag)
-            elif catformatid == 1:
-                if len(uin) > 2 and entry_exists(catid, int(uin[2:])):
-                    entry_nr = int(uin[2:])
-                    remove_form_1(category, tag, entry_nr)
+        if catformatid == 0:
+            remove_form_0(category, tag)
+        elif uin[2:].isdigit() and entry_exists(catid, int(uin[2:])):
+            entry_nr = int(uin[2:])
+            if catformatid == 1:
+                remove_form_1(category, tag, entry_nr)
             elif catformatid == 2:
-                if len(uin) > 2 and entry_exists(catid, int(uin[2:])):
-                    entry_nr = int(uin[2:])
-                    remove_form_2(category, tag, entry_nr)
-        os.system('clear')
-        display_overview(active_tag)
-
-    elif active_tag is not None and uin.startswith('mv ') and catid_exists(uin[3]):
-        # move single entries between categories and or tags
-        move_request = uin.split(' ')[1:]
-        if catid_exists(move_request[1][0]):
-            org_tag = active_tag
-            org_catid = ord(move_request[0][0])-65
-            org_category = catconf[(ord(move_request[0][0])-65)][0]
-            org_catformatid = catconf[(ord(move_request[0][0])-65)][1]
-            if len(move_request[0]) > 1:
-                try:
-                    org_entry_nr = int(move_request[0][1:])
-                except:
-                    print("You can move tags in non tag mode only!")
-                    return pensive_shell(active_tag)
-            else:
-                org_entry_nr = None
-
-            if '@' not in move_request[1]:
-                target_tag = active_tag
-                target_category = catconf[(ord(move_request[1][0])-65)][0]
-                target_catformatid = catconf[(ord(move_request[1][0])-65)][1]
-            elif '@' in move_request[1]:
-                target_tag = move_request[1].split('@')[1]
-                target_category = catconf[(ord(move_request[1].split('@')[0][0])-65)][0]
-                target_catformatid = catconf[(ord(move_request[1].split('@')[0][0])-65)][1]
-
-            if target_tag not in defined_tags:
-                if not ask_yes_no(target_tag, 2):
-                    return pensive_shell(active_tag)
-                else:
-                    add_tag_to_db(target_tag)
-            cond = (
-                catid_exists(move_request[1].split('@')[0][0]) and
-                target_catformatid == org_catformatid)
-            if not cond:
-                print((
-                    "Categories don't exist or don't share same format. "
-                    "Operation cancelled."))
-                return pensive_shell(active_tag)
-            if target_catformatid == 0 and tag_results[org_catid][2] != 0:
-                args = (org_category, org_tag, target_category, target_tag)
-                move_format_0_entry(*args)
-            elif (target_catformatid == 1 and org_entry_nr is not None and
-                    entry_exists(org_catid, org_entry_nr)):
-                args = (
-                    org_category, org_tag, org_entry_nr,
-                    target_category, target_tag)
-                move_format_1_entry(*args)
-            elif (target_catformatid == 2 and org_entry_nr is not None and
-                    entry_exists(org_catid, org_entry_nr)):
-                args = (
-                    org_category, org_tag, org_entry_nr,
-                    target_category, target_tag)
-                move_format_2_entry(*args)
-            os.system('clear')
-            display_overview(active_tag)
-    else:
-        display_help()
-    return pensive_shell(active_tag)
+                remove_form_2(category, tag, entry_nr)
+    clear_screen()
+    display_overview(active_tag)
+    return active_tag
+
+
+SHELL_COMMANDS = {
+    'license': shell_license,
+    'help': shell_help,
+    'ls': shell_ls,
+    'add': shell_add,
+    'rm': shell_rm,
+    'mv': shell_mv,
+    '?': shell_query,
+    '??': shell_search,
+    'category': shell_category,
+    'backup': shell_backup,
+    'restore': shell_restore,
+    'export': shell_export,
+    'import': shell_import,
+    'check': shell_check,
+    'stats': shell_stats,
+    'benchmark': shell_benchmark,
+    'q': shell_quit,
+    'quit': shell_quit,
+    '*': shell_edit,
+    '-': shell_remove_entry,
+    'A': shell_category_letter,
+}
+
+
+# commands, which need a terminal or see the database through connections of
+# their own, which miss the uncommitted changes of a batch, and are skipped in
+# batch mode
+INTERACTIVE_COMMANDS = ('*', 'backup', 'restore', 'license', 'benchmark')
+
+
+def get_command_key(uin):
+    """Returns the key of SHELL_COMMANDS, which handles the input."""
+    if uin.startswith('??') and len(uin) > 2:
+        return '??'
+    elif uin.startswith('?') and len(uin) > 1 and uin[1] != '?':
+        return '?'
+    elif uin.startswith('?'):
+        # '?' or '??' without a tag or pattern
+        return None
+    elif uin[:1] in ('*', '-'):
+        return uin[0]
+    elif uin[:1] in ascii_uppercase:
+        return 'A'
+    return uin.split(' ')[0]
+
+
+def execute_command(uin, active_tag=None):
+    """Executes a single command and returns the tag, which is active
+    afterwards."""
+    handler = SHELL_COMMANDS.get(get_command_key(uin), shell_unknown)
+    return handler(uin, active_tag)
+
+
+def run_batch(fin):
+    """Executes the commands of a file object line by line without clearing
+    the screen or asking questions. All changes are committed in a single
+    transaction at the end and rolled back, if a command fails."""
+    active_tag = None
+    for line_nr, uin in enumerate(fin, 1):
+        uin = uin.rstrip('\n')
+        if uin.strip() == '' or uin.startswith('#'):
+            continue
+        key = get_command_key(uin)
+        if key == 'q' or key == 'quit':
+            break
+        elif key in INTERACTIVE_COMMANDS:
+            print("Line %i: '%s' is not available in batch mode." % (
+                line_nr, uin))
+            continue
+        try:
+            active_tag = execute_command(uin, active_tag)
+        except Exception as error:
+            con.rollback()
+            print("%s Line %i: '%s' failed (%s). Nothing changed." % (
+                RED + "Error:" + DEL_COLOR, line_nr, uin, error))
+            return False
+    con.commit()
+    return True
 
 
-os.system('clear')
+def pensive_shell(active_tag=None):
+    """Central command line interface. Commands are read in a loop and
+    dispatched by execute_command(). Mostly 'basic functions' as they are
+    named in the help view deactivate the tag, but generally the active tag
+    is kept, if possible."""
+    while True:
+        report_backups()
+        # prompt handling
+        prompt = ':'
+        if active_tag is not None:
+            prompt = '[%s]:' % active_tag
+        uin = input(prompt)
+        active_tag = sync_external_changes(active_tag)
+        try:
+            active_tag = execute_command(uin, active_tag)
+        except sqlite3.OperationalError as error:
+            if not is_locked_error(error):
+                raise
+            con.rollback()
+            print("%s '%s' failed, because another process locks the "
+                  "database (%s)." % (RED + "Error:" + DEL_COLOR, uin, error))
+
+
+parser = argparse.ArgumentParser(
+    description='pensive is a CLI program for organizing knowledge.')
+parser.add_argument(
+    '--batch', nargs='?', const='-', metavar='FILE',
+    help="execute the commands of FILE (or stdin, if FILE is '-' or omitted) "
+    "without prompts in a single transaction")
+args = parser.parse_args()
+BATCH_MODE = args.batch is not None
+
+clear_screen()
 cwd = os.getcwd()
 get_configuration()
-con = sqlite3.connect(DB)
+con = connect_db(DB)
 cursor = con.cursor()
 
-print(
-    "pensive Copyright (C) 2015 Georg Alexander Murzik\n"
-    "This program is free software and comes with ABSOLUTELY NO WARRANTY.\n"
-    "You are welcome to redistribute it under certain conditions.\n"
-    "Type 'license' for distribution details, 'help' for help or 'q' to quit.")
+if not BATCH_MODE:
+    print(
+        "pensive Copyright (C) 2015 Georg Alexander Murzik\n"
+        "This program is free software and comes with ABSOLUTELY NO WARRANTY.\n"
+        "You are welcome to redistribute it under certain conditions.\n"
+        "Type 'license' for distribution details, 'help' for help or 'q' to "
+        "quit.")
 
 try:
     get_categories()
 
 except sqlite3.OperationalError:
-    print('\nWelcome to pensive!')
     install_pensive_base()
-    question = "Do you want to take the quick tour? [Y/n]: "
-    answer = input(question)
-    if answer.lower() == 'y' or answer.lower() == 'yes' or answer == '':
-        do_tutorial()
+    if not BATCH_MODE:
+        print('\nWelcome to pensive!')
+        question = "Do you want to take the quick tour? [Y/n]: "
+        answer = input(question)
+        if answer.lower() == 'y' or answer.lower() == 'yes' or answer == '':
+            do_tutorial()
 
 finally:
     get_tags()
 
+migrate_db()
+sync_fulltext_indexes()
+sync_external_changes(None)
+
+if BATCH_MODE:
+    if args.batch == '-':
+        success = run_batch(sys.stdin)
+    else:
+        fin = open(args.batch)
+        with fin:
+            success = run_batch(fin)
+    con.close()
+    sys.exit(0 if success else 1)
+
 try:
     pensive_shell()
 except KeyboardInterrupt or EOFError: